@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# Weather alerts (onecall "alerts") laid out for the forecast area of mode 1.
+#
+# The description of an alert is split into paragraphs (blank lines, "###"
+# separators, "* WHAT..." bullets and "Label:" headings), whitespace is
+# collapsed and every paragraph is wrapped to the pixel width of the area
+# (textmeasure.py). The lines are cut into pages of what fits the height,
+# every alert starts on a page of its own.
+#
+# The panel shows one page per refresh, the page changes every
+# ALERT_PAGE_SECONDS of the forecast time. While an alert is in effect the
+# panel refreshes every 15 minutes (budget.CADENCE_ALERT), so the pages take
+# turns.
+# An alert longer than MAX_PAGES_PER_ALERT pages ends with an ellipsis.
+#
+import functools
+import re
+
+import textmeasure
+
+# the refresh cadence while an alert is in effect, see budget.CADENCE_ALERT
+ALERT_PAGE_SECONDS = 15 * 60
+MAX_PAGES_PER_ALERT = 3
+
+URL_SCHEME = re.compile(r"https?://")
+PARAGRAPH_BREAK = re.compile(r"\n#+\n|\n\s*\n|\n(?=\* )|\s+(?=[A-Za-z]+:(?!//))")
+WHITESPACE = re.compile(r"\s+")
+
+
+def getParagraphs(description):
+    description = URL_SCHEME.sub("", description)
+    paragraphs = []
+    for paragraph in PARAGRAPH_BREAK.split(description):
+        paragraph = WHITESPACE.sub(" ", paragraph).strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+
+# the alert texts stay the same between refreshes, so does the wrapping
+@functools.lru_cache(maxsize=32)
+def wrapDescription(description, font, width):
+    lines = []
+    for paragraph in getParagraphs(description):
+        lines += textmeasure.wrapText(paragraph, font, width)
+    return tuple(lines)
+
+
+# [(alert, lines)], one entry per page
+def getAlertPages(alerts, font, width, maxLines):
+    pages = []
+    for alert in alerts:
+        lines = wrapDescription(alert.get("description", ""), font, width)
+        count = min(MAX_PAGES_PER_ALERT, max(1, -(-len(lines) // maxLines)))
+        for page in range(count):
+            pages.append((alert, list(lines[page * maxLines : (page + 1) * maxLines])))
+        if len(lines) > count * maxLines:
+            last = pages[-1][1]
+            last[-1] = textmeasure.truncateLine(last[-1], font, width)
+    return pages
+
+
+# index of the page shown at the forecast time now
+def getPageIndex(pages, now):
+    return int(now // ALERT_PAGE_SECONDS) % len(pages)
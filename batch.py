@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+#
+# Batch renderer for many panels / locations
+#
+#   WI_DIR=... python3 batch.py profiles.txt [--jobs N] [--fixtures DIR]
+#
+# profiles.txt has one section per panel, the keys override the settings of
+# config.txt (or --config) for that panel, plus where the frame goes:
+#
+#   [toronto]
+#   LAT=43.65
+#   LON=-79.38
+#   mode=2
+#   INKY_SIZE=73
+#   OUTPUT=/srv/frames/toronto.png
+#
+#   [office]
+#   LAT=52.52
+#   LON=13.40
+#   DISPLAY=inky
+#
+# OUTPUT writes a png, otherwise the frame goes to DISPLAY like update() does.
+# Relative paths (profiles.txt, --config, --fixtures, OUTPUT) are taken from
+# the directory batch.py is started in.
+#
+# All requests of all profiles are collected first, identical ones (same
+# location, another mode or size) are fetched once, all of them concurrently
+# and through the response cache. The frames are rendered in a process pool
+# (drawing and matplotlib are CPU bound), a worker writes its png itself and
+# only frames for a display are sent back to this process.
+#
+import argparse
+import configparser
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import display
+import fetcher
+import quantize
+import timing
+import weather
+
+SECTION = "openweathermap"
+
+# concurrent HTTP requests for the whole batch
+FETCH_WORKERS = 8
+
+
+# path relative to where batch.py was started, absolute ones as they are
+def getLaunchPath(path):
+    if not path:
+        return path
+    return os.path.join(weather.launch_dir, path)
+
+
+def loadProfiles(path, base):
+    profiles = configparser.ConfigParser()
+    with open(path) as profileFile:
+        profiles.read_file(profileFile)
+
+    result = []
+    for name in profiles.sections():
+        config = configparser.ConfigParser()
+        config.read_dict({SECTION: dict(base.items(SECTION, raw=True))})
+        # the one time message of config.txt is not meant for every panel
+        config.set(SECTION, "one_time_message", "")
+        for key, value in profiles.items(name, raw=True):
+            config.set(SECTION, key, value)
+        result.append((name, config))
+    return result
+
+
+# fetch every distinct request of all profiles once
+# returns {uri: json}, a failed request (or one over the API budget without a
+# cached response) is left out
+def fetchProfiles(profiles, cache, budget):
+    pending = {}
+    for name, config in profiles:
+        for endpoint, uri in weather.getRequestURIs(config).items():
+            pending.setdefault(uri, endpoint)
+    logging.info(
+        "Batch : %d profiles, %d distinct requests" % (len(profiles), len(pending))
+    )
+
+    fetcher.setMaxParallelRequests(min(FETCH_WORKERS, max(1, len(pending))))
+    futures = {
+        uri: fetcher.getExecutor().submit(
+            fetcher.fetchJSON, uri, fetcher.REQUEST_TIMEOUT, endpoint, cache, budget
+        )
+        for uri, endpoint in pending.items()
+    }
+    responses = {}
+    for uri, future in futures.items():
+        try:
+            responses[uri] = future.result()
+        except Exception as e:
+            logging.warning(
+                "Batch : request failed " + fetcher.getCacheURI(uri) + " : " + str(e)
+            )
+    return responses
+
+
+# fetch replacement for weatherInfomation answering from the batch responses
+class batchFetch(object):
+    def __init__(self, responses):
+        self.responses = responses
+
+    def __call__(self, uris):
+        return {name: self.responses[uri] for name, uri in uris.items()}
+
+
+# runs in a worker process
+# job : (name, {key: value} of the profile config, {uri: json}, output path)
+# returns (name, error, frame) where frame is None when it was written to a png
+def renderProfile(job):
+    name, settings, responses, output = job
+    config = configparser.ConfigParser()
+    config.read_dict({SECTION: settings})
+    try:
+        wi = weather.weatherInfomation(config, batchFetch(responses))
+        if hasattr(wi, "weatherInfo") is False:
+            return (name, wi.one_time_message, None)
+        cv = weather.renderFrame(wi)
+        if output:
+            cv.save(output)
+            return (name, None, None)
+        return (name, None, (cv.mode, cv.size, cv.tobytes(), cv.getpalette()))
+    except Exception as e:
+        return (name, repr(e), None)
+
+
+# display drivers by (DISPLAY, INKY_SIZE), created once per batch
+screens = {}
+
+
+def showFrame(config, frame):
+    from PIL import Image
+
+    mode, size, data, palette = frame
+    cv = Image.frombytes(mode, size, data)
+    if palette is not None:
+        cv.putpalette(palette)
+    quantizer = config.get(SECTION, "QUANTIZE", fallback="driver")
+    if quantizer == "pil" and cv.mode != "P":
+        cv = quantize.quantizeImage(cv, weather.saturation)
+
+    key = (weather.getDisplayName(config), config.get(SECTION, "INKY_SIZE"))
+    if key not in screens:
+        screens[key] = display.getDisplay(
+            key[0], key[1], weather.tmpfs_path + "weather-impression.png"
+        )
+    screen = screens[key]
+    screen.setBusy(True)
+    try:
+        screen.show(cv, weather.saturation)
+    finally:
+        screen.setBusy(False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch renderer")
+    parser.add_argument("profiles", help="ini file, one section per panel")
+    parser.add_argument("--config", default=weather.project_root + "/config.txt")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--fixtures",
+        help="directory with onecall.json and forecast.json to render from",
+    )
+    args = parser.parse_args()
+    # importing weather changed the working directory to WI_DIR
+    args.profiles = getLaunchPath(args.profiles)
+    args.config = getLaunchPath(args.config)
+    if args.fixtures:
+        args.fixtures = getLaunchPath(args.fixtures)
+
+    base = configparser.ConfigParser()
+    with open(args.config) as configFile:
+        base.read_file(configFile)
+    profiles = loadProfiles(args.profiles, base)
+
+    with timing.span("batch.fetch"):
+        if args.fixtures:
+            fixtures = fetcher.getFixtureFetch(
+                {
+                    "onecall": os.path.join(args.fixtures, "onecall.json"),
+                    "rain": os.path.join(args.fixtures, "forecast.json"),
+                }
+            )
+            responses = {}
+            for name, config in profiles:
+                uris = weather.getRequestURIs(config)
+                for endpoint, data in fixtures(uris).items():
+                    responses[uris[endpoint]] = data
+        else:
+            responses = fetchProfiles(
+                profiles, weather.getResponseCache(base), weather.getAPIBudget(base)
+            )
+
+    # every worker only gets the responses its profile needs
+    jobs = []
+    for name, config in profiles:
+        uris = weather.getRequestURIs(config).values()
+        jobs.append(
+            (
+                name,
+                dict(config.items(SECTION, raw=True)),
+                {uri: responses[uri] for uri in uris if uri in responses},
+                getLaunchPath(config.get(SECTION, "OUTPUT", fallback="")),
+            )
+        )
+
+    failed = 0
+    configs = dict(profiles)
+    # spawn : the fetch threads of this process are not forked along
+    with timing.span("batch.render"), ProcessPoolExecutor(
+        max_workers=max(1, min(args.jobs, len(jobs))),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=weather.warmFonts,
+    ) as pool:
+        for name, error, frame in pool.map(renderProfile, jobs):
+            if error is not None:
+                failed += 1
+                logging.error("Batch : " + name + " failed : " + error)
+            elif frame is not None:
+                with timing.span("batch.display"):
+                    showFrame(configs[name], frame)
+            logging.info("Batch : " + name + " done")
+    timing.exportAll(weather.tmpfs_path, "batch")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
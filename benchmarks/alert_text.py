@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Alert text benchmark
+#
+#   python3 benchmarks/alert_text.py [--runs N] [--sizes 57,73]
+#
+# Lays out the long alert texts in benchmarks/fixtures/alerts.json (NWS,
+# Environment Canada and DWD bulletins) for the mode 1 forecast area, one
+# alert at a time and all of them together:
+#
+#   regex : the str.replace / re.sub wrap at 90 characters mode 1 used before
+#   cold  : alerts.getAlertPages with empty glyph and wrap caches
+#   warm  : alerts.getAlertPages again, what a refresh with the same alerts costs
+#
+# Every line alerts.py lays out is measured with font.getlength (kerning
+# included), the script fails when one is wider than the area. The widest
+# line of the regex wrap is printed for comparison.
+#
+import argparse
+import json
+import logging
+import os
+import re
+import statistics
+import sys
+import time
+
+import render  # noqa: E402, benchmarks/render.py, sets up sys.path and WI_DIR
+
+import alerts  # noqa: E402
+import textmeasure  # noqa: E402
+import weather  # noqa: E402
+
+
+# mode 1 before alerts.py
+def regexWrap(description):
+    desc = description.replace("\n###\n", "")
+    desc = desc.replace("\n\n", "")
+    desc = desc.replace("https://", "")
+    desc = re.sub(r"([A-Za-z]*:)", "\n\g<1>", desc)
+    desc = re.sub(r"((?=.{90})(.{0,89}([\.[ ]|[ ]))|.{0,89})", "\g<1>\n", desc)
+    desc = desc.replace("\n\n", "")
+    return desc.split("\n")
+
+
+def clearCaches():
+    textmeasure.getAdvance.cache_clear()
+    alerts.wrapDescription.cache_clear()
+
+
+def timeIt(function, runs, setup=None):
+    samples = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alert text benchmark")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--sizes", default="57,73")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with open(os.path.join(render.fixture_root, "alerts.json")) as alertFile:
+        fixtures = json.load(alertFile)
+    font = weather.getFont(weather.fonts.normal, fontsize=14)
+    lineHeight = textmeasure.getLineHeight(font)
+
+    print(
+        "size alert                  | regex ms  cold ms  warm ms | lines pages |"
+        " widest regex/area"
+    )
+    failed = False
+    for size in args.sizes.split(","):
+        width, height = weather.getCanvasSize(size)
+        # the description area of mode 1, see drawWeather
+        areaWidth = width - 10 - 15
+        maxLines = int((height - 5 - 270) // lineHeight)
+        cases = [(alert["event"][:22], [alert]) for alert in fixtures]
+        cases.append(("all %d" % len(fixtures), fixtures))
+        for name, items in cases:
+            regexLines, regexMs = timeIt(
+                lambda: [line for a in items for line in regexWrap(a["description"])],
+                args.runs,
+            )
+            pages, coldMs = timeIt(
+                lambda: alerts.getAlertPages(items, font, areaWidth, maxLines),
+                args.runs,
+                clearCaches,
+            )
+            pages, warmMs = timeIt(
+                lambda: alerts.getAlertPages(items, font, areaWidth, maxLines),
+                args.runs,
+            )
+            lines = [line for alert, page in pages for line in page]
+            widest = max(font.getlength(line) for line in lines)
+            widestRegex = max(font.getlength(line) for line in regexLines)
+            failed = failed or widest > areaWidth
+            print(
+                "%-4s %-22s | %8.3f %8.3f %8.3f | %5d %5d | %5d %5d / %d"
+                % (
+                    size,
+                    name,
+                    regexMs,
+                    coldMs,
+                    warmMs,
+                    len(lines),
+                    len(pages),
+                    widestRegex,
+                    widest,
+                    areaWidth,
+                )
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
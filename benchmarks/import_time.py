@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#
+# Import time budget of weather.py
+#
+#   python3 benchmarks/import_time.py [--budget SECONDS] [--runs N]
+#
+# Imports weather in a fresh interpreter with -X importtime, reports the best
+# run and the slowest modules, and fails when the budget is exceeded or when
+# a hardware library got imported on the way.
+#
+import argparse
+import os
+import subprocess
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# must only be imported once a display backend needs them
+hardware_modules = ("inky", "gpiod", "RPi", "spidev", "smbus2")
+
+
+def measureImport(module):
+    env = dict(os.environ)
+    env.setdefault("WI_DIR", project_root)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=project_root,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+
+    # "import time:  self [us] | cumulative | imported package"
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(selfTime), int(cumulative))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time budget of weather.py")
+    parser.add_argument("--module", default="weather")
+    parser.add_argument("--budget", type=float, default=1.5, help="seconds")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measureImport(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda modules: modules[args.module][1])
+    total = best[args.module][1] / 1e6
+
+    print("import " + args.module + " : %.3fs (best of %d)" % (total, args.runs))
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (_, cumulative) in slowest[1 : args.top + 1]:
+        print("  %8.3fs  %s" % (cumulative / 1e6, name))
+
+    failed = False
+    loaded = [
+        name for name in best if name.split(".")[0] in hardware_modules
+    ]
+    if len(loaded) > 0:
+        print("hardware modules imported : " + ", ".join(sorted(loaded)))
+        failed = True
+    if total > args.budget:
+        print("over budget : %.3fs > %.3fs" % (total, args.budget))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
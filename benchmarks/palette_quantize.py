@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Palette quantisation benchmark
+#
+#   python3 benchmarks/palette_quantize.py [--runs N] [--modes 0,1,2,4] [--sizes 57,73]
+#
+# Renders the fixture frames (see render.py) and maps them to the panel
+# colours three ways:
+#
+#   driver   : what inky.set_image does with an RGB image (Floyd-Steinberg)
+#   pil      : image.quantize against the same palette without dithering
+#   quantize : quantize.quantizeImage, what QUANTIZE=pil hands the driver
+#
+# quantize has to match pil pixel for pixel (with the black padding entries
+# of the driver palette folded to black, see quantize.py), for the frames
+# and for a noise image covering the whole colour range, the script fails
+# otherwise. How many pixels the dithering of the driver changes is
+# printed as well.
+#
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import render  # noqa: E402, benchmarks/render.py, sets up sys.path and WI_DIR
+
+import fetcher  # noqa: E402
+import quantize  # noqa: E402
+import weather  # noqa: E402
+
+
+def driverQuantize(cv, paletteImage):
+    # inky_uc8159.Inky.set_image
+    cv.load()
+    return Image.Image()._new(cv.im.convert("P", True, paletteImage.im))
+
+
+def pilQuantize(cv, paletteImage):
+    return cv.quantize(palette=paletteImage, dither=Image.Dither.NONE)
+
+
+def timeIt(function, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Palette quantisation benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default="0,1,2,4")
+    parser.add_argument("--sizes", default="57,73")
+    parser.add_argument("--saturation", type=float, default=weather.saturation)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    fetch = fetcher.getFixtureFetch(
+        {
+            "onecall": os.path.join(render.fixture_root, "onecall.json"),
+            "rain": os.path.join(render.fixture_root, "forecast.json"),
+        }
+    )
+    paletteImage = quantize.getPaletteImage(args.saturation)
+
+    frames = []
+    for mode in args.modes.split(","):
+        for size in args.sizes.split(","):
+            config = render.getConfig(mode, size, "EN", [])
+            wi = weather.weatherInfomation(config, fetch)
+            frames.append(("mode %s size %s" % (mode, size), weather.renderFrame(wi)))
+    # the whole colour range
+    noise = np.random.default_rng(0).integers(0, 256, (1024, 1024, 3), dtype=np.uint8)
+    frames.append(("noise", Image.fromarray(noise, "RGB")))
+
+    print(
+        "frame            | driver ms   pil ms  quant ms | quant!=pil | driver!=quant"
+    )
+    failed = False
+    for name, cv in frames:
+        driver, driverMs = timeIt(lambda: driverQuantize(cv, paletteImage), args.runs)
+        pil, pilMs = timeIt(lambda: pilQuantize(cv, paletteImage), args.runs)
+        indexed, quantMs = timeIt(
+            lambda: quantize.quantizeImage(cv, args.saturation), args.runs
+        )
+        indexed = np.asarray(indexed)
+        mismatch = int((indexed != quantize.foldPadding(np.asarray(pil))).sum())
+        dithered = float((indexed != quantize.foldPadding(np.asarray(driver))).mean())
+        failed = failed or mismatch > 0
+        print(
+            "%-16s | %9.1f %8.1f %8.1f | %10d | %12.2f%%"
+            % (name, driverMs, pilMs, quantMs, mismatch, dithered * 100)
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+#
+# Offline render benchmark
+#
+#   python3 benchmarks/render.py [--runs N] [--modes 0,1,2,3,4] [--sizes 57,73]
+#                                [--langs EN,DE] [--set KEY=VALUE ...] [--json]
+#
+# Replays the recorded API responses in benchmarks/fixtures through
+# weatherInfomation and drawWeather for every mode, panel size and language,
+# and reports the wall time of each stage, the allocations while rendering
+# and the peak RSS. No network and no panel are needed.
+#
+# Allocations are the python heap traced by tracemalloc, the pixel buffers of
+# PIL and the Agg renderer live outside of it and only show up in peak RSS.
+#
+#   setup  : weatherInfomation (unit conversion, forecast model)
+#   render : renderFrame (canvas, drawWeather, graphs)
+#   hash   : widget hashes of the frame (what update() compares before
+#            touching the panel, see regions.py)
+#
+import argparse
+import configparser
+import itertools
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+benchmark_root = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmark_root)
+fixture_root = os.path.join(benchmark_root, "fixtures")
+
+sys.path.insert(0, project_root)
+os.environ.setdefault("WI_DIR", project_root)
+
+import fetcher  # noqa: E402
+import regions  # noqa: E402
+import weather  # noqa: E402
+
+
+def getConfig(mode, size, lang, overrides):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(project_root, "config.txt.default"))
+    config.set("openweathermap", "API_KEY", "fixture")
+    config.set("openweathermap", "mode", mode)
+    config.set("openweathermap", "INKY_SIZE", size)
+    config.set("openweathermap", "LANG", lang)
+    config.set("openweathermap", "one_time_message", "")
+    for key, value in overrides:
+        config.set("openweathermap", key, value)
+    return config
+
+
+def getPeakRSS():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def renderOnce(config, fetch):
+    timings = {}
+    start = time.perf_counter()
+    wi = weather.weatherInfomation(config, fetch)
+    timings["setup"] = time.perf_counter() - start
+    if hasattr(wi, "weatherInfo") is False:
+        raise RuntimeError(wi.one_time_message)
+
+    start = time.perf_counter()
+    cv = weather.renderFrame(wi)
+    timings["render"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    regions.getRegions(
+        cv, weather.getFrameKey(cv, "png"), weather.getWidgetBoxes(wi, cv.size)
+    )
+    timings["hash"] = time.perf_counter() - start
+    return timings
+
+
+def measureAllocations(config, fetch):
+    wi = weather.weatherInfomation(config, fetch)
+    tracemalloc.start()
+    try:
+        weather.renderFrame(wi)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    return peak / 1024, blocks
+
+
+def benchmarkCase(mode, size, lang, runs, overrides, fetch):
+    config = getConfig(mode, size, lang, overrides)
+    # the first run pays for font loading, imports and figure creation
+    first = renderOnce(config, fetch)
+    samples = [renderOnce(config, fetch) for _ in range(runs)]
+    allocKB, blocks = measureAllocations(config, fetch)
+
+    result = {"mode": mode, "size": size, "lang": lang}
+    result.update({"first_ms": {}, "median_ms": {}, "min_ms": {}})
+    for stage in first:
+        values = [sample[stage] * 1000 for sample in samples]
+        result["first_ms"][stage] = first[stage] * 1000
+        result["median_ms"][stage] = statistics.median(values)
+        result["min_ms"][stage] = min(values)
+    result["alloc_peak_kb"] = allocKB
+    result["alloc_live_blocks"] = blocks
+    result["peak_rss_mb"] = getPeakRSS()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline render benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default="0,1,2,3,4")
+    parser.add_argument("--sizes", default="57,73")
+    parser.add_argument("--langs", default="EN,DE")
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="KEY=VALUE",
+        help="config.txt setting for every case, e.g. MODE2_GRAPH=native",
+    )
+    parser.add_argument("--json", action="store_true", help="print json lines")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    overrides = [item.split("=", 1) for item in args.set]
+    fetch = fetcher.getFixtureFetch(
+        {
+            "onecall": os.path.join(fixture_root, "onecall.json"),
+            "rain": os.path.join(fixture_root, "forecast.json"),
+        }
+    )
+
+    if args.json is False:
+        print(
+            "mode size lang | first ms | setup ms render ms  hash ms (median)"
+            " | alloc peak KB | peak RSS MB"
+        )
+    failed = False
+    cases = itertools.product(
+        args.modes.split(","), args.sizes.split(","), args.langs.split(",")
+    )
+    for mode, size, lang in cases:
+        try:
+            result = benchmarkCase(mode, size, lang, args.runs, overrides, fetch)
+        except Exception as e:
+            failed = True
+            result = {"mode": mode, "size": size, "lang": lang, "error": repr(e)}
+        if args.json:
+            print(json.dumps(result))
+        elif "error" in result:
+            print("%4s %4s %4s | failed : %s" % (mode, size, lang, result["error"]))
+        else:
+            median = result["median_ms"]
+            print(
+                "%4s %4s %4s | %8.1f | %8.1f %9.1f %8.1f          | %13.0f | %11.1f"
+                % (
+                    mode,
+                    size,
+                    lang,
+                    sum(result["first_ms"].values()),
+                    median["setup"],
+                    median["render"],
+                    median["hash"],
+                    result["alloc_peak_kb"],
+                    result["peak_rss_mb"],
+                )
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+#
+# API call budget and refresh cadence.
+#
+# apiBudget counts the requests sent per endpoint and UTC day (the day the
+# OpenWeatherMap quota is counted in), kept in tmpfs so a restarted watcher
+# goes on counting. fetcher.fetchJSON asks it before a request goes out, an
+# exhausted endpoint is served from the response cache instead.
+#
+# getRefreshInterval plans the next scheduled refresh from the forecast:
+# often while an alert is in effect or rain is coming, rarely at night, and
+# never more often than the rest of the day's budget allows.
+#
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# OpenWeatherMap free tier, One Call API 3.0
+DEFAULT_DAILY_LIMIT = 1000
+
+# seconds between scheduled refreshes
+CADENCE_DEFAULT = 60 * 60
+CADENCE_ALERT = 15 * 60
+CADENCE_RAIN = 20 * 60
+CADENCE_NIGHT = 3 * 60 * 60
+
+# rain is imminent when it is likely(pop) within the next hours
+RAIN_HOURS = 3
+RAIN_POP = 0.5
+
+
+# the first scheduled refresh after start, at :01 like the fixed hourly
+# schedule used to be
+def getFirstRefresh(now=None):
+    start = datetime.fromtimestamp(now or time.time())
+    first = start.replace(minute=1, second=0, microsecond=0)
+    if first <= start:
+        first += timedelta(hours=1)
+    return first.timestamp()
+
+
+class budgetExhausted(Exception):
+    pass
+
+
+def getDay(now=None):
+    return datetime.fromtimestamp(now or time.time(), timezone.utc).strftime("%Y-%m-%d")
+
+
+# seconds until the quota is reset(UTC midnight)
+def getSecondsLeftToday(now=None):
+    now = now or time.time()
+    return 86400 - (int(now) % 86400)
+
+
+class apiBudget(object):
+    # path : json file with today's counts(tmpfs)
+    # limits : {endpoint: calls per day}
+    def __init__(self, path, limits=None):
+        self.path = path
+        self.limits = limits or {}
+        self.lock = threading.Lock()
+        self.day = getDay()
+        self.counts = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as budgetFile:
+                stored = json.load(budgetFile)
+            if stored.get("day") == self.day:
+                self.counts = dict(stored["counts"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Ignoring unreadable budget " + self.path + ": " + str(e))
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as budgetFile:
+            json.dump({"day": self.day, "counts": self.counts}, budgetFile)
+        os.replace(self.path + ".tmp", self.path)
+
+    # a new day starts with a new quota
+    def rollOver(self):
+        day = getDay()
+        if day != self.day:
+            self.day = day
+            self.counts = {}
+
+    def getLimit(self, endpoint):
+        return self.limits.get(endpoint, DEFAULT_DAILY_LIMIT)
+
+    def remaining(self, endpoint):
+        with self.lock:
+            self.rollOver()
+            return max(0, self.getLimit(endpoint) - self.counts.get(endpoint, 0))
+
+    # count a request that is about to be sent, budgetExhausted when there
+    # is none left today
+    def spend(self, endpoint):
+        with self.lock:
+            self.rollOver()
+            used = self.counts.get(endpoint, 0)
+            if used >= self.getLimit(endpoint):
+                raise budgetExhausted(
+                    "API budget for " + endpoint + " used up today (%d calls)" % used
+                )
+            self.counts[endpoint] = used + 1
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning("Could not store API budget: " + str(e))
+
+
+def isAlertActive(weatherInfo, now):
+    for alert in weatherInfo.get("alerts", []):
+        if alert.get("start", 0) <= now <= alert.get("end", now):
+            return True
+    return False
+
+
+def isRainImminent(weatherInfo):
+    for hour in weatherInfo.get("hourly", [])[:RAIN_HOURS]:
+        if hour.get("pop", 0) >= RAIN_POP or "rain" in hour or "snow" in hour:
+            return True
+    return False
+
+
+def isNight(weatherInfo, now):
+    current = weatherInfo.get("current", {})
+    if "sunrise" not in current or "sunset" not in current:
+        return False
+    return now < current["sunrise"] or now > current["sunset"]
+
+
+# seconds until the next scheduled refresh and why
+# weatherInfo : onecall payload of the last refresh, None when it failed
+# endpoints : the endpoints a refresh calls
+def getRefreshInterval(weatherInfo, budget, endpoints, now=None):
+    now = now or time.time()
+    if weatherInfo is None:
+        interval, reason = CADENCE_DEFAULT, "no data"
+    elif isAlertActive(weatherInfo, now):
+        interval, reason = CADENCE_ALERT, "alert"
+    elif isNight(weatherInfo, now):
+        interval, reason = CADENCE_NIGHT, "night"
+        if isRainImminent(weatherInfo):
+            interval, reason = CADENCE_DEFAULT, "rain at night"
+    elif isRainImminent(weatherInfo):
+        interval, reason = CADENCE_RAIN, "rain"
+    else:
+        interval, reason = CADENCE_DEFAULT, "default"
+
+    if budget is None:
+        return interval, reason
+
+    # spread what is left of the budget over the rest of the day
+    secondsLeft = getSecondsLeftToday(now)
+    remaining = min([budget.remaining(endpoint) for endpoint in endpoints] or [1])
+    if remaining == 0:
+        return secondsLeft + 60, "budget used up"
+    floor = secondsLeft / remaining
+    if floor > interval:
+        return int(floor), reason + ", budget"
+    return interval, reason
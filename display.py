@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Display backends for the rendered canvas.
+#
+#   inky : Pimoroni Inky Impression panel, busy LED on GPIO 4
+#   png  : write the frame to a png file (headless / off-device rendering)
+#   null : render only, the frame is dropped
+#
+# The hardware libraries (inky, gpiod) are imported when an inky backend is
+# created, so rendering on a machine without them never loads them.
+#
+import logging
+
+import timing
+
+
+def initGPIO():
+    import gpiod
+
+    chip = gpiod.chip(0)  # 0 chip
+    pin = 4
+    gpiod_pin = chip.get_line(pin)
+    config = gpiod.line_request()
+    config.consumer = "Blink"
+    config.request_type = gpiod.line_request.DIRECTION_OUTPUT
+    gpiod_pin.request(config)
+    return gpiod_pin
+
+
+def setUpdateStatus(gpiod_pin, busy):
+    if busy is True:
+        gpiod_pin.set_value(1)
+    else:
+        gpiod_pin.set_value(0)
+
+
+class inkyDisplay(object):
+    name = "inky"
+    # a panel refresh takes long, an identical frame is not sent again
+    skip_unchanged = True
+
+    def __init__(self, inky_size):
+        # the auto setup does for some reason do not work on some
+        # raspberries - so using the explicit imports
+        # from inky.auto import auto
+        if inky_size == "57":
+            from inky import Inky7Colour as _Inky
+        else:
+            from inky import Inky_Impressions_7 as _Inky
+        self.inky = _Inky()
+        self.gpio_pin = initGPIO()
+
+    def setBusy(self, busy):
+        setUpdateStatus(self.gpio_pin, busy)
+
+    def show(self, cv, saturation):
+        with timing.span("display.set_image"):
+            self.inky.set_image(cv, saturation=saturation)
+        with timing.span("display.show"): # long running
+            self.inky.show()
+
+
+class pngDisplay(object):
+    name = "png"
+    skip_unchanged = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def setBusy(self, busy):
+        pass
+
+    def show(self, cv, saturation):
+        with timing.span("display.save"):
+            cv.save(self.path)
+        logging.info('Frame written to ' + self.path)
+
+
+class nullDisplay(object):
+    name = "null"
+    skip_unchanged = False
+
+    def setBusy(self, busy):
+        pass
+
+    def show(self, cv, saturation):
+        pass
+
+
+def getDisplay(name, inky_size, png_path=None):
+    if name == "inky":
+        return inkyDisplay(inky_size)
+    elif name == "png":
+        return pngDisplay(png_path)
+    elif name == "null":
+        return nullDisplay()
+    else:
+        raise TypeError("Invalid display : " + name)
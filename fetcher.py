@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# HTTP fetch layer for the OpenWeatherMap endpoints.
+#
+# The session and the worker threads live at module level, so a long running
+# process (watcher.py) keeps its keep-alive connections between refreshes
+# instead of paying a new TCP+TLS handshake for every request.
+#
+# Responses can be kept in an on-disk cache (tmpfs) so that button presses
+# shortly after a refresh render from the cached payload instead of spending
+# API calls.
+#
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import timing
+from budget import budgetExhausted
+
+# (connect, read) timeout in seconds for every request
+REQUEST_TIMEOUT = (5, 20)
+
+# onecall + rain forecast are fetched side by side
+MAX_PARALLEL_REQUESTS = 2
+
+_session = None
+_executor = None
+
+
+def getSession():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=MAX_PARALLEL_REQUESTS,
+            pool_maxsize=MAX_PARALLEL_REQUESTS,
+            max_retries=1,
+        )
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def getExecutor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=MAX_PARALLEL_REQUESTS, thread_name_prefix="fetch"
+        )
+    return _executor
+
+
+# the batch renderer fetches many locations at once, it widens the
+# connection pool and the worker threads before the first request
+def setMaxParallelRequests(count):
+    global MAX_PARALLEL_REQUESTS, _executor
+    if count == MAX_PARALLEL_REQUESTS:
+        return
+    closeSession()
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    MAX_PARALLEL_REQUESTS = count
+
+
+# uri without the api key, used to identify a cached response
+def getCacheURI(uri):
+    parts = urlsplit(uri)
+    query = [
+        (key, value)
+        for key, value in parse_qsl(parts.query)
+        if key.lower() != "appid"
+    ]
+    return urlunsplit(parts._replace(query=urlencode(sorted(query))))
+
+
+class responseCache(object):
+    def __init__(self, path, ttls=None):
+        # path : directory for the cache files (tmpfs)
+        # ttls : {endpoint name: seconds a response is considered fresh}
+        self.path = path
+        self.ttls = ttls or {}
+
+    def getEntryPath(self, name, uri):
+        digest = hashlib.sha1(getCacheURI(uri).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, "owm-" + name + "-" + digest[:16] + ".json")
+
+    def load(self, name, uri):
+        try:
+            with open(self.getEntryPath(name, uri)) as entryFile:
+                return json.load(entryFile)
+        except (OSError, ValueError):
+            return None
+
+    def isFresh(self, name, entry):
+        return time.time() - entry["fetched"] < self.ttls.get(name, 0)
+
+    def store(self, name, uri, data, headers=None):
+        headers = headers or {}
+        entry = {
+            "uri": getCacheURI(uri),
+            "fetched": time.time(),
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "data": data,
+        }
+        entryPath = self.getEntryPath(name, uri)
+        # write-rename so a reader never sees a half written entry
+        with open(entryPath + ".tmp", "w") as entryFile:
+            json.dump(entry, entryFile)
+        os.replace(entryPath + ".tmp", entryPath)
+        return entry
+
+    # a 304 answer renews the entry without a new payload
+    def touch(self, name, uri, entry):
+        return self.store(
+            name,
+            uri,
+            entry["data"],
+            {"ETag": entry.get("etag"), "Last-Modified": entry.get("last_modified")},
+        )
+
+
+# budget : budget.apiBudget, a request is only sent while there is budget left
+def fetchJSON(uri, timeout=REQUEST_TIMEOUT, name=None, cache=None, budget=None):
+    entry = cache.load(name, uri) if cache is not None else None
+    if entry is not None and cache.isFresh(name, entry):
+        logging.info("Request " + name + " served from cache")
+        return entry["data"]
+
+    # revalidate the cached response when the server gave us a validator
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    try:
+        if budget is not None:
+            budget.spend(name)
+        with timing.span("fetch." + str(name), revalidate=entry is not None):
+            response = getSession().get(uri, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            cache.touch(name, uri, entry)
+            return entry["data"]
+        response.raise_for_status()
+        data = response.json()
+    except (requests.RequestException, ValueError, budgetExhausted) as e:
+        if entry is None:
+            raise
+        # stale-while-error : an old forecast is better than no forecast
+        logging.warning(
+            "Request " + name + " failed (" + str(e) + "), using cached response"
+        )
+        return entry["data"]
+
+    if cache is not None:
+        try:
+            cache.store(name, uri, data, response.headers)
+        except OSError as e:
+            logging.warning("Could not store " + name + " response: " + str(e))
+    return data
+
+
+# fetch {name: uri} and return {name: json}, all requests are issued at once
+def fetchAll(uris, timeout=REQUEST_TIMEOUT, cache=None, budget=None):
+    if len(uris) == 1:
+        name, uri = next(iter(uris.items()))
+        return {name: fetchJSON(uri, timeout, name, cache, budget)}
+
+    futures = {
+        name: getExecutor().submit(fetchJSON, uri, timeout, name, cache, budget)
+        for name, uri in uris.items()
+    }
+    results = {}
+    for name, future in futures.items():
+        results[name] = future.result()
+        logging.info("Request " + name + " done")
+    return results
+
+
+# fetch replacement answering from recorded responses, paths is
+# {name: json file}. The files are parsed once and shared between calls.
+def getFixtureFetch(paths):
+    fixtures = {}
+    for name, path in paths.items():
+        with open(path) as fixtureFile:
+            fixtures[name] = json.load(fixtureFile)
+
+    def fetch(uris):
+        return {name: fixtures[name] for name in uris}
+
+    return fetch
+
+
+def closeSession():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# Line graphs drawn straight onto the canvas with ImageDraw and NumPy.
+#
+# The geometry follows the matplotlib graphs of drawWeather (figure size in
+# inches at 100dpi, default subplot margins, 5% data margins and the padding
+# added by bbox_inches="tight"), so a graph lands at the same place on the
+# canvas without matplotlib ever being imported.
+#
+import numpy as np
+
+import timing
+
+DPI = 100
+# matplotlib figure.subplot.* defaults
+SUBPLOT_LEFT = 0.125
+SUBPLOT_RIGHT = 0.9
+SUBPLOT_BOTTOM = 0.11
+SUBPLOT_TOP = 0.88
+# matplotlib axes.xmargin / axes.ymargin
+DATA_MARGIN = 0.05
+# matplotlib savefig.pad_inches
+PAD_INCHES = 0.1
+# linestyle ":" is a 1 on, 1.65 off pattern scaled by the line width
+DOTTED_PATTERN = (1.0, 1.65)
+
+
+def pointsToPixels(points):
+    return points * DPI / 72.0
+
+
+# data limits with margins, flat data is widened like matplotlib does
+def getLimits(values):
+    lo = float(np.min(values))
+    hi = float(np.max(values))
+    if hi - lo < 1e-12:
+        if lo == 0:
+            lo, hi = -0.05, 0.05
+        else:
+            lo, hi = lo - 0.05 * abs(lo), hi + 0.05 * abs(hi)
+    margin = (hi - lo) * DATA_MARGIN
+    return (lo - margin, hi + margin)
+
+
+# split a polyline into dashes of on/off pixels along its length
+def getDashes(points, on, off):
+    lengths = np.hypot(*np.diff(points, axis=0).T)
+    distance = np.concatenate(([0.0], np.cumsum(lengths)))
+    starts = np.arange(0.0, distance[-1], on + off)
+    ends = np.minimum(starts + on, distance[-1])
+
+    dashes = []
+    for start, end in zip(starts, ends):
+        inner = distance[(distance > start) & (distance < end)]
+        along = np.concatenate(([start], inner, [end]))
+        xs = np.interp(along, distance, points[:, 0])
+        ys = np.interp(along, distance, points[:, 1])
+        dashes.append(list(zip(xs.tolist(), ys.tolist())))
+    return dashes
+
+
+def drawPolyline(draw, points, color, linewidth, dotted=False):
+    width = max(1, int(round(pointsToPixels(linewidth))))
+    if dotted is False:
+        draw.line(
+            list(map(tuple, points.tolist())), fill=color, width=width, joint="curve"
+        )
+        return
+    on, off = [pointsToPixels(linewidth * p) for p in DOTTED_PATTERN]
+    for dash in getDashes(points, on, off):
+        draw.line(dash, fill=color, width=width)
+
+
+class lineGraph(object):
+    def __init__(self, graph_size, origin, name="graph"):
+        # graph_size : (height, width) in inches, see getGraphSize
+        # origin : canvas position the matplotlib image used to be pasted at
+        # name : used for the timing span
+        self.name = name
+        graph_height, graph_width = graph_size
+        width = graph_width * DPI
+        height = graph_height * DPI
+        self.origin = origin
+        # axes box in figure pixels, y grows downwards as in PIL
+        self.left = SUBPLOT_LEFT * width
+        self.right = SUBPLOT_RIGHT * width
+        self.top = (1 - SUBPLOT_TOP) * height
+        self.bottom = (1 - SUBPLOT_BOTTOM) * height
+        self.ylim = None
+        # series and vertical lines, drawn in the order they were added
+        self.lines = []
+        self.labels = []
+
+    def plot(self, x, y, color, linewidth=3, dotted=False):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.lines.append((x, y, color, linewidth, dotted))
+
+    def axvline(self, x, color=(0, 0, 0), linewidth=1.5, dotted=True):
+        self.lines.append((np.array([float(x)]), None, color, linewidth, dotted))
+
+    def text(self, x, y, text, font, color=(0, 0, 0)):
+        # anchored at the left baseline like plt.text
+        self.labels.append((float(x), float(y), text, font, color))
+
+    def setYLim(self, lo, hi):
+        self.ylim = (lo, hi)
+
+    def draw(self, draw):
+        with timing.span("graph." + self.name, native=True):
+            self.drawLines(draw)
+
+    def drawLines(self, draw):
+        series = [line for line in self.lines if line[1] is not None]
+        if len(series) == 0:
+            return
+        xlo, xhi = getLimits(np.concatenate([line[0] for line in series]))
+        ylo, yhi = self.ylim or getLimits(np.concatenate([line[1] for line in series]))
+
+        def toFigure(x, y):
+            px = (np.asarray(x) - xlo) / (xhi - xlo) * (self.right - self.left)
+            py = (np.asarray(y) - ylo) / (yhi - ylo) * (self.bottom - self.top)
+            return self.left + px, self.bottom - py
+
+        # the tight bbox is the axes box plus labels sticking out of it
+        cropLeft = self.left
+        cropTop = self.top
+        labels = []
+        for x, y, text, font, color in self.labels:
+            px, py = toFigure(x, y)
+            left, top, _, _ = font.getbbox(text, anchor="ls")
+            cropLeft = min(cropLeft, px + left)
+            cropTop = min(cropTop, py + top)
+            labels.append((px, py, text, font, color))
+        pad = PAD_INCHES * DPI
+        offsetX = self.origin[0] - (cropLeft - pad)
+        offsetY = self.origin[1] - (cropTop - pad)
+
+        for x, y, color, linewidth, dotted in self.lines:
+            if y is None:
+                # vertical line over the full axes height
+                px, _ = toFigure(x[0], ylo)
+                points = np.array([[px, self.top], [px, self.bottom]])
+            else:
+                points = np.column_stack(toFigure(x, y))
+            drawPolyline(draw, points + (offsetX, offsetY), color, linewidth, dotted)
+
+        for px, py, text, font, color in labels:
+            draw.text((px + offsetX, py + offsetY), text, color, anchor="ls", font=font)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Palette quantisation of the canvas without the dithering of the driver.
+#
+# inky.set_image quantises an RGB image against the palette blended from
+# SATURATED_PALETTE and DESATURATED_PALETTE for the given saturation, with
+# Floyd-Steinberg dithering. quantizeImage maps every pixel to its nearest
+# panel colour with PIL's own undithered quantize instead, the result is a
+# "P" image with the panel colour indices that the driver takes as it is.
+# On the flat colours of our frames the two only differ along anti-aliased
+# edges.
+#
+# The driver pads its palette with black entries, colours closer to pure
+# black than to the blended black (e.g. our black text) end up on index 8
+# and above, which is no panel colour. They are folded to black.
+#
+import functools
+
+import numpy as np
+from PIL import Image
+
+# palettes of inky.inky_uc8159, index = panel colour
+# DESATURATED is what we draw with, SATURATED is closer to what the panel shows
+DESATURATED_PALETTE = [
+    (0, 0, 0),
+    (255, 255, 255),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 0, 0),
+    (255, 255, 0),
+    (255, 140, 0),
+    (255, 255, 255),
+]
+SATURATED_PALETTE = [
+    (57, 48, 57),
+    (255, 255, 255),
+    (58, 91, 70),
+    (61, 59, 94),
+    (156, 72, 75),
+    (208, 190, 71),
+    (177, 106, 73),
+    (255, 255, 255),
+]
+
+# Image.point table of a "P" image folding the black padding entries to black
+FOLD_POINT = list(range(len(DESATURATED_PALETTE))) + [0] * (
+    256 - len(DESATURATED_PALETTE)
+)
+
+
+# flat [r, g, b, ...] palette the driver quantises against (Inky._palette_blend)
+def getPalette(saturation):
+    palette = []
+    for i in range(7):
+        rs, gs, bs = [c * saturation for c in SATURATED_PALETTE[i]]
+        rd, gd, bd = [c * (1.0 - saturation) for c in DESATURATED_PALETTE[i]]
+        palette += [int(rs + rd), int(gs + gd), int(bs + bd)]
+    return palette + [255, 255, 255]
+
+
+# the 7 colours + clear, the other 248 entries zeroed like the driver does.
+# Built once per saturation, quantize only reads it.
+@functools.lru_cache(maxsize=4)
+def getPaletteImage(saturation):
+    paletteImage = Image.new("P", (1, 1))
+    paletteImage.putpalette(getPalette(saturation) + [0, 0, 0] * 248)
+    return paletteImage
+
+
+# indices of the black padding entries -> black
+def foldPadding(indices):
+    return np.where(indices >= len(DESATURATED_PALETTE), 0, indices).astype(np.uint8)
+
+
+# RGB canvas -> "P" image of panel colour indices
+def quantizeImage(cv, saturation):
+    if cv.mode != "RGB":
+        cv = cv.convert("RGB")
+    indexed = cv.quantize(
+        palette=getPaletteImage(saturation), dither=Image.Dither.NONE
+    ).point(FOLD_POINT)
+    indexed.putpalette(getPalette(saturation))
+    return indexed
+
+
+def getCanvasPalette():
+    return [c for color in DESATURATED_PALETTE for c in color]
+
+
+# new "P" canvas, the palette index of every colour is the panel colour
+def newCanvas(size, color):
+    cv = Image.new("P", size, color)
+    cv.putpalette(getCanvasPalette())
+    return cv
+
+
+# colours drawn on a "P" canvas that are not panel colours (e.g. the grey of
+# the forecast text) are appended to its palette by PIL. They are mapped to
+# the panel colour quantizeImage gives them and the palette is cut back.
+def remapCanvas(cv, saturation):
+    palette = np.array(cv.getpalette(), dtype=np.uint8).reshape(-1, 3)
+    count = len(DESATURATED_PALETTE)
+    if len(palette) <= count:
+        return cv
+    stray = Image.fromarray(palette[count:].reshape(1, -1, 3), "RGB")
+    table = np.arange(256, dtype=np.uint8)
+    table[count : len(palette)] = np.asarray(quantizeImage(stray, saturation))[0]
+    # point works on the indices of a "P" image
+    remapped = cv.point(table.tolist())
+    remapped.putpalette(getCanvasPalette())
+    return remapped
+
+
+# RGBA graph -> panel colours on a "P" canvas. P can't blend, the graph is
+# pasted where it is at least half opaque.
+def pasteImage(cv, image, position, saturation):
+    mask = image.getchannel("A").point([0] * 128 + [255] * 128)
+    indexed = quantizeImage(image.convert("RGB"), saturation)
+    indexed.putpalette(getCanvasPalette())
+    cv.paste(indexed, position, mask)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Single worker refresh scheduler for watcher.py.
+#
+# Button presses (GPIO callback thread) and the hourly schedule job only
+# post a request, one worker thread does the refreshes. Requests that come
+# in before the worker picked up the pending one are merged into it:
+#
+#   - the latest reason wins, force stays set once any request forced it
+#   - every request restarts the debounce delay, so a burst of presses
+#     ends in a single refresh showing the final state
+#   - actions (config changes of a button) run in the order they came in,
+#     on the worker, right before the refresh
+#
+# Only the worker calls refresh, so two panel updates never overlap.
+#
+import logging
+import threading
+import time
+
+# seconds to wait for more button presses before refreshing
+DEBOUNCE = 0.5
+
+
+class refreshQueue(object):
+    # refresh : function(reason, force)
+    def __init__(self, refresh, debounce=DEBOUNCE):
+        self.refresh = refresh
+        self.debounce = debounce
+        self.condition = threading.Condition()
+        self.reason = None
+        self.force = False
+        self.actions = []
+        self.due = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="refresh", daemon=True)
+        self.thread.start()
+
+    # action : called on the worker before the refresh, e.g. a config change
+    # delay : seconds to wait for more requests, the debounce delay if None
+    def request(self, reason="schedule", force=False, action=None, delay=None):
+        with self.condition:
+            if self.reason is not None:
+                logging.info("Refresh " + reason + " merged with " + self.reason)
+            self.reason = reason
+            self.force = self.force or force
+            if action is not None:
+                self.actions.append(action)
+            self.due = time.monotonic() + (self.debounce if delay is None else delay)
+            self.condition.notify()
+
+    def isPending(self):
+        with self.condition:
+            return self.reason is not None
+
+    # wait for the next due request, None once stopped
+    def take(self):
+        with self.condition:
+            while self.stopped is False:
+                if self.reason is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.due - time.monotonic()
+                if remaining <= 0:
+                    request = (self.reason, self.force, self.actions)
+                    self.reason = None
+                    self.force = False
+                    self.actions = []
+                    return request
+                self.condition.wait(remaining)
+            return None
+
+    def run(self):
+        while True:
+            request = self.take()
+            if request is None:
+                return
+            reason, force, actions = request
+            for action in actions:
+                try:
+                    action()
+                except Exception:
+                    logging.exception("Refresh action for " + reason + " failed")
+            try:
+                self.refresh(reason, force)
+            except Exception:
+                logging.exception("Refresh " + reason + " failed")
+
+    # pending requests are dropped, a running refresh is finished
+    def stop(self, timeout=None):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(timeout)
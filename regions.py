@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Dirty regions of a frame, per widget of the layout.
+#
+# weather.getWidgetBoxes splits the layout of drawWeather into named boxes
+# (date, weekday, temperature, icon, description, forecast columns, graph
+# band...) that together cover the whole canvas. Every box of a rendered
+# frame is hashed on its own, the hashes of the frame last shown are kept in
+# tmpfs. The boxes whose hash changed are the dirty regions of the next
+# frame. When none changed the frame is the one that is shown already.
+#
+# key : fingerprint of everything else that decides about what is shown
+#       (display, canvas mode and size, saturation, palette), a new key
+#       makes every box dirty
+#
+import hashlib
+import json
+import logging
+import os
+
+
+# {"key": key, "widgets": {name: [box, sha1 of the pixels in box]}}
+def getRegions(cv, key, boxes):
+    widgets = {}
+    for name, box in boxes.items():
+        digest = hashlib.sha1(cv.crop(box).tobytes()).hexdigest()
+        widgets[name] = [list(box), digest]
+    return {"key": key, "widgets": widgets}
+
+
+# names of the widgets of current that differ from previous
+def getDirtyWidgets(previous, current):
+    if previous is None or previous.get("key") != current["key"]:
+        return list(current["widgets"])
+    return [
+        name
+        for name, widget in current["widgets"].items()
+        if previous["widgets"].get(name) != widget
+    ]
+
+
+# box around all the dirty widgets, None when there are none
+def getDirtyBox(current, names):
+    boxes = [current["widgets"][name][0] for name in names]
+    if len(boxes) == 0:
+        return None
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+# share of the canvas the dirty widgets cover, 0.0 ~ 1.0
+def getDirtyArea(current, names, size):
+    area = 0
+    for name in names:
+        x0, y0, x1, y1 = current["widgets"][name][0]
+        area += (x1 - x0) * (y1 - y0)
+    return area / float(size[0] * size[1])
+
+
+def load(path):
+    try:
+        with open(path) as regionsFile:
+            return json.load(regionsFile)
+    except (OSError, ValueError):
+        return None
+
+
+def store(path, current):
+    try:
+        with open(path + ".tmp", "w") as regionsFile:
+            json.dump(current, regionsFile)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.warning("Could not store frame regions: " + str(e))
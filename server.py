@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+#
+# Headless render server, frames as PNG over HTTP (no panel, no image viewer)
+#
+#   WI_DIR=... python3 server.py [--port 8080] [--config config.txt] [--fixtures DIR]
+#
+#   GET /render?mode=2&size=73&lang=DE&unit=imperial
+#
+# The query overrides mode, INKY_SIZE, LANG and TEMP_UNIT of config.txt (or
+# --config), missing ones keep the configured value.
+#
+# The data comes from the OpenWeatherMap API through the response cache and
+# the API budget like a refresh of the panel, or with --fixtures from the
+# recorded onecall.json and forecast.json in DIR. With --fixtures the server
+# also stands in for the API itself:
+#
+#   GET /data/3.0/onecall?...   GET /data/2.5/forecast?...
+#
+# answer with the recordings, so API_BASE=http://localhost:8080 in config.txt
+# lets the watcher, batch.py or another server render from them.
+#
+# The payloads are kept in memory for CACHE_TTL_ONECALL / CACHE_TTL_RAIN and
+# every payload gets a version (its sha1). Rendered frames are cached by the
+# query and the versions of the data they are drawn from, a frame is drawn
+# again only when the data changed. The version is sent as ETag, a client
+# asking with If-None-Match gets a 304.
+#
+# Requests are handled in threads, cached frames are answered side by side.
+# Drawing reuses the cached graph figures and static layers, one frame is
+# drawn at a time.
+#
+import argparse
+import collections
+import configparser
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+import fetcher
+import timing
+import weather
+
+SECTION = "openweathermap"
+
+# rendered PNGs kept in memory
+MAX_FRAMES = 64
+
+# query parameter -> config key
+RENDER_PARAMS = {
+    "mode": "mode",
+    "size": "INKY_SIZE",
+    "lang": "LANG",
+    "unit": "TEMP_UNIT",
+}
+RENDER_VALUES = {
+    "mode": ("0", "1", "2", "3", "4"),
+    "size": ("57", "73"),
+    "lang": ("EN", "DE"),
+    "unit": (weather.unit_canonical, weather.unit_imperial),
+}
+
+# stand-in API paths -> fixture endpoint
+FIXTURE_PATHS = {
+    "/data/3.0/onecall": "onecall",
+    "/data/2.5/forecast": "rain",
+}
+
+
+def getVersion(data):
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+# payloads by uri with their version, reloaded from the underlying fetch
+# once they are older than the ttl of their endpoint
+class dataSource(object):
+    # fetch : function {name: uri} -> {name: json}, None asks the API
+    # cache : fetcher.responseCache for the API
+    # ttls : {endpoint name: seconds a payload is kept in memory}
+    def __init__(self, fetch=None, cache=None, budget=None, ttls=None):
+        self.fetch = fetch
+        self.cache = cache
+        self.budget = budget
+        self.ttls = ttls or {}
+        self.lock = threading.Lock()
+        # uri -> (loaded, version, data)
+        self.entries = {}
+
+    def isFresh(self, name, entry):
+        return time.time() - entry[0] < self.ttls.get(name, 0)
+
+    def load(self, uris):
+        if self.fetch is not None:
+            return self.fetch(uris)
+        return fetcher.fetchAll(uris, cache=self.cache, budget=self.budget)
+
+    # returns ({name: version}, {name: json})
+    def get(self, uris):
+        with self.lock:
+            stale = {
+                name: uri
+                for name, uri in uris.items()
+                if uri not in self.entries or not self.isFresh(name, self.entries[uri])
+            }
+            if len(stale) > 0:
+                for name, data in self.load(stale).items():
+                    self.entries[stale[name]] = (time.time(), getVersion(data), data)
+            entries = {name: self.entries[uri] for name, uri in uris.items()}
+        versions = {name: entry[1] for name, entry in entries.items()}
+        return versions, {name: entry[2] for name, entry in entries.items()}
+
+
+# fetch replacement for weatherInfomation answering with the loaded payloads
+class loadedFetch(object):
+    def __init__(self, responses):
+        self.responses = responses
+
+    def __call__(self, uris):
+        return {name: self.responses[name] for name in uris}
+
+
+class renderServer(object):
+    # base : parsed config.txt, the defaults of every frame
+    # source : dataSource
+    def __init__(self, base, source):
+        self.base = base
+        self.source = source
+        # {endpoint: json} served as the API, None when not standing in
+        self.fixtures = None
+        # (query, versions) -> (etag, png)
+        self.frames = collections.OrderedDict()
+        self.frames_lock = threading.Lock()
+        self.render_lock = threading.Lock()
+
+    # {param: value} of the query, ValueError for an unknown value
+    def getParams(self, query):
+        params = {}
+        for param, values in parse_qs(query).items():
+            if param not in RENDER_PARAMS:
+                continue
+            if values[-1] not in RENDER_VALUES[param]:
+                raise ValueError(
+                    param + " must be one of " + ", ".join(RENDER_VALUES[param])
+                )
+            params[param] = values[-1]
+        return params
+
+    def getConfig(self, params):
+        config = configparser.ConfigParser()
+        config.read_dict({SECTION: dict(self.base.items(SECTION, raw=True))})
+        # the one time message is for the panel
+        config.set(SECTION, "one_time_message", "")
+        for param, value in params.items():
+            config.set(SECTION, RENDER_PARAMS[param], value)
+        return config
+
+    def getFrame(self, key):
+        with self.frames_lock:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return self.frames[key]
+        return None
+
+    def storeFrame(self, key, frame):
+        with self.frames_lock:
+            self.frames[key] = frame
+            while len(self.frames) > MAX_FRAMES:
+                self.frames.popitem(last=False)
+
+    # returns (etag, png)
+    def render(self, params):
+        config = self.getConfig(params)
+        versions, responses = self.source.get(weather.getRequestURIs(config))
+        key = (tuple(sorted(params.items())), tuple(sorted(versions.items())))
+        frame = self.getFrame(key)
+        if frame is not None:
+            return frame
+
+        with self.render_lock:
+            # drawn by another request meanwhile
+            frame = self.getFrame(key)
+            if frame is not None:
+                return frame
+            with timing.span("server.render", **params):
+                wi = weather.weatherInfomation(config, loadedFetch(responses))
+                if hasattr(wi, "weatherInfo") is False:
+                    raise RuntimeError(wi.one_time_message)
+                cv = weather.renderFrame(wi)
+                png = BytesIO()
+                cv.save(png, "PNG")
+
+            etag = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+            frame = ('"' + etag + '"', png.getvalue())
+            self.storeFrame(key, frame)
+        timing.exportAll(weather.tmpfs_path, "server")
+        return frame
+
+
+class renderHandler(BaseHTTPRequestHandler):
+    server_version = "weather-impression"
+
+    def log_message(self, format, *args):
+        logging.info("Server : " + (format % args))
+
+    def sendBody(self, status, contentType, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sendError(self, status, message):
+        body = (message + "\n").encode("utf-8")
+        self.sendBody(status, "text/plain; charset=utf-8", body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        renderer = self.server.renderer
+        if parts.path == "/render":
+            self.sendRender(renderer, parts.query)
+        elif parts.path in FIXTURE_PATHS and renderer.fixtures is not None:
+            fixture = renderer.fixtures[FIXTURE_PATHS[parts.path]]
+            body = json.dumps(fixture).encode("utf-8")
+            self.sendBody(200, "application/json", body)
+        else:
+            self.sendError(404, "not found")
+
+    def sendRender(self, renderer, query):
+        try:
+            params = renderer.getParams(query)
+        except ValueError as e:
+            self.sendError(400, str(e))
+            return
+        try:
+            etag, png = renderer.render(params)
+        except Exception as e:
+            logging.error("Server : render failed " + repr(e))
+            self.sendError(502, "render failed: " + str(e))
+            return
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.sendBody(
+            200, "image/png", png, {"ETag": etag, "Cache-Control": "no-cache"}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless render server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--config", default=weather.project_root + "/config.txt")
+    parser.add_argument(
+        "--fixtures",
+        help="directory with onecall.json and forecast.json to render from and "
+        "to serve as the API",
+    )
+    args = parser.parse_args()
+    # importing weather changed the working directory to WI_DIR, relative
+    # paths are taken from where server.py was started
+    args.config = os.path.join(weather.launch_dir, args.config)
+    if args.fixtures:
+        args.fixtures = os.path.join(weather.launch_dir, args.fixtures)
+
+    base = configparser.ConfigParser()
+    with open(args.config) as configFile:
+        base.read_file(configFile)
+    ttls = weather.getCacheTTLs(base)
+
+    if args.fixtures:
+        fixtures = {}
+        for name, fileName in (("onecall", "onecall.json"), ("rain", "forecast.json")):
+            with open(os.path.join(args.fixtures, fileName)) as fixtureFile:
+                fixtures[name] = json.load(fixtureFile)
+        renderer = renderServer(base, dataSource(loadedFetch(fixtures), ttls=ttls))
+        renderer.fixtures = fixtures
+    else:
+        # the same response cache and API budget as the watcher
+        source = dataSource(
+            cache=weather.getResponseCache(base),
+            budget=weather.getAPIBudget(base),
+            ttls=ttls,
+        )
+        renderer = renderServer(base, source)
+
+    weather.warmFonts()
+    httpd = ThreadingHTTPServer((args.host, args.port), renderHandler)
+    httpd.daemon_threads = True
+    httpd.renderer = renderer
+    logging.info("Server : listening on http://%s:%d/render" % (args.host, args.port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        fetcher.closeSession()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Runtime state (display mode, temperature unit, one time message) kept
+# apart from config.txt.
+#
+# config.txt holds the defaults. The buttons and the refreshes only change
+# the state, which lives in memory and is written to a small json file by
+# write-rename, and only when a value actually changed. config.txt is never
+# rewritten at runtime.
+#
+# The config value each state value was seeded from is kept as well: when
+# config.txt is edited (updateConfig.py or by hand) and a value there
+# differs from the one seen last time, the new config value wins again.
+# A one time message is shown again whenever config.txt is written, even
+# with the same text (updateConfig.py always writes "Configured."), the
+# stamp of the config.txt last seeded from is kept for that.
+#
+import json
+import logging
+import os
+
+SECTION = "openweathermap"
+
+# state key -> config.txt key
+STATE_KEYS = {
+    "mode": "mode",
+    "unit": "TEMP_UNIT",
+    "one_time_message": "one_time_message",
+}
+
+# state keys seeded again from a new config.txt even when their value is the
+# same, unless it is empty
+RESEED_KEYS = ("one_time_message",)
+
+
+class stateStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        # config.txt value each state value was seeded from
+        self.seeded = {}
+        # (mtime, size) of the config.txt last seeded from
+        self.stamp = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as stateFile:
+                stored = json.load(stateFile)
+            self.values = dict(stored["values"])
+            self.seeded = dict(stored["seeded"])
+            self.stamp = stored.get("stamp")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.warning("Ignoring unreadable state " + self.path + ": " + str(e))
+
+    # write-rename, a power cut leaves either the old or the new file
+    def save(self):
+        with open(self.path + ".tmp", "w") as stateFile:
+            json.dump(
+                {"values": self.values, "seeded": self.seeded, "stamp": self.stamp},
+                stateFile,
+            )
+            stateFile.flush()
+            os.fsync(stateFile.fileno())
+        os.replace(self.path + ".tmp", self.path)
+
+    # take over the config.txt values that are new or changed since last seen
+    # stamp : (mtime, size) of config.txt, a new one reseeds RESEED_KEYS
+    def seed(self, config, stamp=None):
+        newStamp = stamp is not None and list(stamp) != self.stamp
+        changed = False
+        for key, configKey in STATE_KEYS.items():
+            value = config.get(SECTION, configKey, fallback=None)
+            if value is None:
+                continue
+            reseed = newStamp and key in RESEED_KEYS and value != ""
+            if self.seeded.get(key) == value and not reseed:
+                continue
+            self.seeded[key] = value
+            self.values[key] = value
+            changed = True
+        if newStamp:
+            self.stamp = list(stamp)
+            changed = True
+        if changed:
+            self.save()
+
+    def get(self, key, fallback=None):
+        return self.values.get(key, fallback)
+
+    # set several values at once, saved only when one of them changed
+    def update(self, **values):
+        changed = {
+            key: value
+            for key, value in values.items()
+            if self.values.get(key) != value
+        }
+        if len(changed) == 0:
+            return False
+        self.values.update(changed)
+        self.save()
+        return True
+
+    # write the state over the config values read by weatherInfomation
+    def apply(self, config):
+        for key, configKey in STATE_KEYS.items():
+            if key in self.values:
+                config.set(SECTION, configKey, self.values[key])
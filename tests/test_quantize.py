@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# quantizeImage against the driver path (inky.set_image quantises with
+# Floyd-Steinberg dithering against the blended palette). On flat areas of
+# a panel colour the two have to agree, along anti-aliased edges the
+# dithering of the driver picks other colours for a few pixels.
+#
+import os
+import sys
+
+import numpy as np
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image, ImageDraw, ImageFont
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import quantize  # noqa: E402
+
+SATURATIONS = (0.0, 0.5, 1.0)
+
+# share of the pixels the dithering of the driver may change (the fixture
+# frames are at 0.5 ~ 2%)
+MAX_EDGE_MISMATCH = 0.03
+
+# a pixel is flat when every pixel within FLAT_RADIUS has its colour
+FLAT_RADIUS = 2
+
+
+def getPanelColours(saturation):
+    palette = quantize.getPalette(saturation)
+    return [tuple(palette[i : i + 3]) for i in range(0, 21, 3)]
+
+
+# rectangles of every panel colour and anti-aliased text in black and red on
+# white, drawn with the colours the panel shows at saturation
+def getCanvas(saturation):
+    colours = getPanelColours(saturation)
+    cv = Image.new("RGB", (240, 120), colours[1])
+    draw = ImageDraw.Draw(cv)
+    for i, color in enumerate(colours):
+        draw.rectangle((i * 30 + 5, 5, i * 30 + 29, 34), fill=color)
+    font = ImageFont.truetype(os.path.join(ROOT, "fonts", "Roboto-Black.ttf"), 24)
+    draw.text((5, 45), "Cloudy 12°", font=font, fill=colours[0])
+    draw.text((5, 80), "Rain 3 mm", font=font, fill=colours[4])
+    return cv
+
+
+# inky_uc8159.Inky.set_image
+def driverQuantize(cv, saturation):
+    cv.load()
+    paletteImage = quantize.getPaletteImage(saturation)
+    indexed = Image.Image()._new(cv.im.convert("P", True, paletteImage.im))
+    return quantize.foldPadding(np.asarray(indexed))
+
+
+def getFlatMask(cv):
+    pixels = np.asarray(cv)
+    size = 2 * FLAT_RADIUS + 1
+    windows = sliding_window_view(pixels, (size, size, 3))[:, :, 0]
+    inner = pixels[FLAT_RADIUS:-FLAT_RADIUS, FLAT_RADIUS:-FLAT_RADIUS]
+    flat = np.zeros(pixels.shape[:2], dtype=bool)
+    flat[FLAT_RADIUS:-FLAT_RADIUS, FLAT_RADIUS:-FLAT_RADIUS] = (
+        windows == inner[:, :, None, None, :]
+    ).all(axis=(2, 3, 4))
+    return flat
+
+
+@pytest.mark.parametrize("saturation", SATURATIONS)
+def test_quantize_matches_driver(saturation):
+    cv = getCanvas(saturation)
+    indexed = quantize.quantizeImage(cv, saturation)
+    assert indexed.mode == "P"
+    assert indexed.getpalette()[:24] == quantize.getPalette(saturation)
+
+    mismatch = np.asarray(indexed) != driverQuantize(cv, saturation)
+    flat = getFlatMask(cv)
+    assert flat.mean() > 0.5
+    assert not mismatch[flat].any()
+    assert mismatch.mean() < MAX_EDGE_MISMATCH
+
+
+@pytest.mark.parametrize("saturation", SATURATIONS)
+def test_panel_colours_map_to_themselves(saturation):
+    palette = quantize.getPalette(saturation)
+    colours = [tuple(palette[i : i + 3]) for i in range(0, 21, 3)] + [(0, 0, 0)]
+    cv = Image.new("RGB", (len(colours), 1))
+    cv.putdata(colours)
+    indices = list(np.asarray(quantize.quantizeImage(cv, saturation))[0])
+    assert indices == list(range(7)) + [0]
+
+
+@pytest.mark.parametrize("saturation", SATURATIONS)
+def test_remap_canvas_matches_quantize(saturation):
+    stray = [(120, 120, 120), (200, 30, 30), (10, 10, 10), (250, 200, 90)]
+    cv = quantize.newCanvas((len(stray), 1), 1)
+    draw = ImageDraw.Draw(cv)
+    for x, color in enumerate(stray):
+        draw.point((x, 0), fill=color)
+    assert len(cv.getpalette()) > 3 * len(quantize.DESATURATED_PALETTE)
+    rgb = Image.new("RGB", (len(stray), 1))
+    rgb.putdata(stray)
+    remapped = quantize.remapCanvas(cv, saturation)
+    assert remapped.getpalette()[:24] == quantize.getCanvasPalette()
+    assert np.array_equal(
+        np.asarray(remapped), np.asarray(quantize.quantizeImage(rgb, saturation))
+    )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# Text measurement and wrapping with cached glyph advances.
+#
+# The advance of every glyph is measured once per font and kept (getFont
+# hands out one object per font and size, so the font object stands for
+# both). getLength and getSize keep the measures of every (font, string)
+# they were asked for, the layout of a frame looks them up instead of laying
+# the text out again. The numbers change from frame to frame, a string of
+# digits and signs (temperatures, pressure, times) is the sum of its glyph
+# advances, as is a single (icon) glyph.
+#
+# Wrapping a text to a pixel width measures every word against the room
+# left on the line, the width of a word is the sum of its glyph advances.
+# Kerning pairs are not in that sum, lines are wrapped a few pixels short
+# of the width so a kerned line never ends up wider.
+#
+import functools
+
+# spacing between the lines of multiline text, as ImageDraw.multiline_text
+LINE_SPACING = 4
+
+# room kept free at the end of a wrapped line for kerning
+KERNING_MARGIN = 3
+
+ELLIPSIS = "…"
+
+# glyphs without kerning pairs between each other in Roboto, a string of
+# them is as long as the sum of its advances
+ADVANCE_GLYPHS = frozenset("0123456789-+.,: ")
+
+
+@functools.lru_cache(maxsize=4096)
+def getAdvance(font, glyph):
+    return font.getlength(glyph)
+
+
+def getTextWidth(font, text):
+    return sum(getAdvance(font, glyph) for glyph in text)
+
+
+# width of text as ImageDraw.textlength measures it
+@functools.lru_cache(maxsize=1024)
+def getLength(font, text):
+    if len(text) == 1 or ADVANCE_GLYPHS.issuperset(text):
+        return getTextWidth(font, text)
+    return font.getlength(text)
+
+
+# (width, height) the text covers from the origin, what font.getsize gave
+# before Pillow 10
+@functools.lru_cache(maxsize=1024)
+def getSize(font, text):
+    left, top, right, bottom = font.getbbox(text)
+    return (right, bottom)
+
+
+def getCacheInfo():
+    return {
+        "advance": getAdvance.cache_info(),
+        "length": getLength.cache_info(),
+        "size": getSize.cache_info(),
+    }
+
+
+# distance between the tops of two lines
+@functools.lru_cache(maxsize=64)
+def getLineHeight(font, spacing=LINE_SPACING):
+    return font.getbbox("A")[3] + spacing
+
+
+# lines of text no wider than width, broken between words. A word that is
+# wider than a line on its own is broken between glyphs.
+def wrapText(text, font, width):
+    width -= KERNING_MARGIN
+    space = getAdvance(font, " ")
+    lines = []
+    line = ""
+    lineWidth = 0
+    for word in text.split():
+        wordWidth = getTextWidth(font, word)
+        if line and lineWidth + space + wordWidth <= width:
+            line += " " + word
+            lineWidth += space + wordWidth
+            continue
+        if line:
+            lines.append(line)
+        line, lineWidth = word, wordWidth
+        while lineWidth > width and len(line) > 1:
+            cut = 1
+            cutWidth = getAdvance(font, line[0])
+            while cut < len(line) and cutWidth + getAdvance(font, line[cut]) <= width:
+                cutWidth += getAdvance(font, line[cut])
+                cut += 1
+            lines.append(line[:cut])
+            line = line[cut:]
+            lineWidth = getTextWidth(font, line)
+    if line:
+        lines.append(line)
+    return lines
+
+
+# line cut to width with an ellipsis at the end
+def truncateLine(line, font, width):
+    width -= KERNING_MARGIN + getAdvance(font, ELLIPSIS)
+    while line and getTextWidth(font, line) > width:
+        line = line[:-1]
+    return line.rstrip() + ELLIPSIS
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Local time of the forecast location and the labels drawn from it.
+#
+# The onecall payload carries the offset of the location from UTC
+# (timezone_offset, seconds). The hourly dt column is converted once per
+# fetch with numpy, dt + offset split into days, hours and minutes, instead
+# of a localtime/strftime call per point and label. The frame shows the
+# time of the location, whatever TZ the host runs in.
+#
+# timezone_offset is the offset at the time of the request. When a DST
+# switch falls into the 48 hours of the forecast the offset of every hour is
+# looked up in the timezone of the payload (timezone, e.g. "Europe/Berlin")
+# instead. A timezone zoneinfo doesn't know (or a Python without zoneinfo)
+# keeps timezone_offset.
+#
+# The labels are formatted once per value (and language) and cached, the
+# formats are the ones the strftime calls gave on linux with the C locale.
+#
+import functools
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    # Python 3.8, the timezone_offset of the payload is used as it is
+    ZoneInfo = None
+
+MONTHS = (
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+)
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+@functools.lru_cache(maxsize=8)
+def getZone(name):
+    if not name or ZoneInfo is None:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def getZoneOffset(zone, timestamp):
+    return int(datetime.fromtimestamp(int(timestamp), zone).utcoffset().total_seconds())
+
+
+# seconds east of UTC of the timestamps, offset when it is the same for all
+# of them, an array of per timestamp offsets when a DST switch is in between
+# zoneName : timezone of the payload, None uses offset as it is
+def getOffsets(dt, offset=0, zoneName=None):
+    zone = getZone(zoneName)
+    if zone is None or len(dt) == 0:
+        return offset
+    if getZoneOffset(zone, dt[0]) == getZoneOffset(zone, dt[-1]):
+        return offset
+    return np.array([getZoneOffset(zone, t) for t in dt], dtype=np.int64)
+
+
+# local days since the epoch, hour and minute of the timestamps
+class localTimes(object):
+    # dt : unix timestamps (array or list)
+    # offset : seconds east of UTC, timezone_offset of the payload or the
+    #          per timestamp offsets of getOffsets
+    def __init__(self, dt, offset=0):
+        local = np.asarray(dt, dtype=np.int64) + np.asarray(offset, dtype=np.int64)
+        self.day = local // 86400
+        seconds = local % 86400
+        self.hour = seconds // 3600
+        self.minute = seconds % 3600 // 60
+
+    def __len__(self):
+        return len(self.hour)
+
+
+# (local day, hour, minute) of a single timestamp
+def getLocalTime(timestamp, offset=0):
+    local = int(timestamp) + int(offset)
+    seconds = local % 86400
+    return local // 86400, seconds // 3600, seconds % 3600 // 60
+
+
+# minutes since local midnight
+def getMinuteOfDay(timestamp, offset=0):
+    day, hour, minute = getLocalTime(timestamp, offset)
+    return hour * 60 + minute
+
+
+# "AM" | "PM"
+def getMeridiem(hour):
+    return "AM" if hour < 12 else "PM"
+
+
+# 1 ~ 12
+def getHour12(hour):
+    return (hour + 11) % 12 + 1
+
+
+# (month, day of month, weekday) names of a local day, "%B", "%-d" and "%a"
+@functools.lru_cache(maxsize=32)
+def getDateLabels(day):
+    date = datetime.fromtimestamp(int(day) * 86400, timezone.utc)
+    return MONTHS[date.month - 1], str(date.day), WEEKDAYS[date.weekday()]
+
+
+# "%-I %p", e.g. "7 AM"
+@functools.lru_cache(maxsize=24)
+def getHourLabel(hour):
+    return "%d %s" % (getHour12(hour), getMeridiem(hour))
+
+
+# "%#I:%M %p" as linux formats it, e.g. "07:05 AM"
+@functools.lru_cache(maxsize=64)
+def getClockLabel(hour, minute):
+    return "%02d:%02d %s" % (getHour12(hour), minute, getMeridiem(hour))
+
+
+# "%B %-d, %H:%M %p", e.g. "October 17, 14:00 PM"
+def getDateTimeLabel(timestamp, offset=0):
+    day, hour, minute = getLocalTime(timestamp, offset)
+    month, dayOfMonth, weekday = getDateLabels(day)
+    return "%s %s, %02d:%02d %s" % (month, dayOfMonth, hour, minute, getMeridiem(hour))
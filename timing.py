@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Timing spans for the refresh pipeline.
+#
+#   with timing.span("fetch.onecall"):
+#       ...
+#
+# Every finished span is logged, kept in a ring buffer and added to per-name
+# totals. exportAll writes them as json lines and as a Prometheus text file
+# (node_exporter textfile collector format) so the refresh budget of a real
+# device can be looked at.
+#
+import collections
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+MAX_SPANS = 512
+
+spans = collections.deque(maxlen=MAX_SPANS)
+# name -> [count, total seconds, last seconds]
+totals = {}
+_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    logging.info(name + " START")
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        record = {
+            "name": name,
+            "start": started,
+            "seconds": duration,
+            "thread": threading.current_thread().name,
+        }
+        if labels:
+            record["labels"] = labels
+        if error is not None:
+            record["error"] = error
+        with _lock:
+            spans.append(record)
+            total = totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = duration
+        logging.info(name + " END (%.3fs)" % duration)
+
+
+def getSpans():
+    with _lock:
+        return list(spans)
+
+
+# write-rename, readers (node_exporter, tail) never see a partial file. The
+# threads of a process may export at the same time, each writes its own temp
+# file and the last rename wins. mkstemp creates it 0600, the exports are
+# made readable for a collector that runs as another user than the watcher.
+def writeAtomic(path, text):
+    fd, tmpPath = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + "."
+    )
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as outFile:
+            outFile.write(text)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+def exportJSONLines(path):
+    writeAtomic(path, "".join(json.dumps(record) + "\n" for record in getSpans()))
+
+
+# process : label of the exporting process, the files of the watcher,
+#           server.py and batch.py are collected side by side
+def exportPrometheus(path, prefix="weather_impression_span", process="watcher"):
+    with _lock:
+        rows = sorted((name, list(total)) for name, total in totals.items())
+    lines = [
+        "# HELP " + prefix + "_seconds Duration of the last run of a refresh stage.",
+        "# TYPE " + prefix + "_seconds gauge",
+    ]
+    labels = {name: 'span="%s",process="%s"' % (name, process) for name, _ in rows}
+    for name, (_, _, last) in rows:
+        lines.append("%s_seconds{%s} %f" % (prefix, labels[name], last))
+    lines += [
+        "# HELP " + prefix + "_seconds_total Time spent in a refresh stage.",
+        "# TYPE " + prefix + "_seconds_total counter",
+    ]
+    for name, (_, seconds, _) in rows:
+        lines.append("%s_seconds_total{%s} %f" % (prefix, labels[name], seconds))
+    lines += [
+        "# HELP " + prefix + "_runs_total Number of runs of a refresh stage.",
+        "# TYPE " + prefix + "_runs_total counter",
+    ]
+    for name, (count, _, _) in rows:
+        lines.append("%s_runs_total{%s} %d" % (prefix, labels[name], count))
+    writeAtomic(path, "\n".join(lines) + "\n")
+
+
+# every process exports to files of its own, process is "watcher", "server"
+# or "batch". The watcher keeps the plain weather-impression names.
+def exportAll(path, process="watcher"):
+    name = "weather-impression"
+    if process != "watcher":
+        name += "-" + process
+    try:
+        exportJSONLines(os.path.join(path, name + "-spans.jsonl"))
+        exportPrometheus(os.path.join(path, name + ".prom"), process=process)
+    except OSError as e:
+        logging.warning("Could not export timings: " + str(e))
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
 import RPi.GPIO as GPIO
-import configparser
+import functools
+import logging
 import os
 import schedule
 import time
 
+import refreshqueue
+
 # config file should be the same folder.
 if not os.environ.get('WI_DIR'):
     raise TypeError('Missing WI_DIR ENVIRONMENT variable')
@@ -28,59 +31,86 @@ GPIO.setmode(GPIO.BCM)
 GPIO.setup(BUTTONS, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 
 
+# the render service stays resident for the life of the watcher: display
+# driver, GPIO line, fonts, HTTP session (fetcher.py) and the parsed
+# config.txt are set up once and reused by every refresh.
+service = None
+
+
+def getService():
+    global service
+    if service is None:
+        import weather
+
+        service = weather.renderService(configFilePath)
+    return service
+
+
 # refresh inky impression screen
-def refreshScreen():
-    import weather
+# reason : what triggered the refresh, shows up in the logs and timings
+# force : redraw the panel even when the frame did not change
+def refreshScreen(reason="schedule", force=False):
+    getService().refresh(reason, force)
 
-    weather.update()
 
+# set up the render service before the first refresh, so a button press
+# or the first scheduled refresh doesn't pay for imports, fonts and driver.
+# Runs before the refresh worker and the buttons are set up.
+def warmUp():
+    try:
+        getService().prepare()
+    except Exception as e:
+        logging.error(
+            "Render service setup failed, retrying on the next refresh: " + repr(e)
+        )
 
-# "handle_button" will be called every time a button is pressed
-# It receives one argument: the associated input pin.
-def handle_button(pin):
-    config = configparser.ConfigParser()
-    config.read_file(open(configFilePath))
+
+warmUp()
+
+
+# state change of a button, runs on the refresh worker right before the
+# refresh so presses are applied in order and never race with a refresh.
+# mode and unit live in the state store of the render service (state.py),
+# config.txt is not rewritten.
+def applyButton(pin):
+    state = getService().loadState()
 
     # Top button(Forecasts)
     if pin == 5:
-        config.set("openweathermap", "one_time_message", "MODE:Forecast")
-        config.set("openweathermap", "mode", "0")
-        with open(configFilePath, "w") as configfile:
-            config.write(configfile)
+        state.update(mode="0", one_time_message="MODE:Forecast")
 
     # Second button(Graph mode)
     if pin == 6:
-        config.set("openweathermap", "one_time_message", "MODE:Graph")
-        config.set("openweathermap", "mode", "2")
-        with open(configFilePath, "w") as configfile:
-            config.write(configfile)
+        state.update(mode="2", one_time_message="MODE:Graph")
 
     # Second button( mode)
     if pin == 16:
-        config.set("openweathermap", "one_time_message", "MODE:Alert")
-        config.set("openweathermap", "mode", "1")
-        with open(configFilePath, "w") as configfile:
-            config.write(configfile)
+        state.update(mode="1", one_time_message="MODE:Alert")
 
     # 4th button(C/F)
+    # the forecast is fetched in metric and converted locally, so the cached
+    # response from the last refresh is reused.
     if pin == 24:
-        unit = config.get("openweathermap", "TEMP_UNIT", raw=False)
-        if unit == "imperial":
-            config.set("openweathermap", "one_time_message", "Unit:Metric")
-            config.set("openweathermap", "TEMP_UNIT", "metric")
+        if state.get("unit") == "imperial":
+            state.update(unit="metric", one_time_message="Unit:Metric")
         else:
-            config.set("openweathermap", "one_time_message", "Unit:Imperial")
-            config.set("openweathermap", "TEMP_UNIT", "imperial")
+            state.update(unit="imperial", one_time_message="Unit:Imperial")
 
-        with open(configFilePath, "w") as configfile:
-            config.write(configfile)
 
-    # refresh the screen
-    try:
-        refreshScreen()
-    except:
-        print("Weather update failed.")
-        pass
+# refreshes run one at a time on the worker of this queue, a burst of button
+# presses ends in a single refresh with the final mode/unit.
+refreshes = refreshqueue.refreshQueue(refreshScreen)
+
+
+# "handle_button" will be called every time a button is pressed
+# It receives one argument: the associated input pin.
+def handle_button(pin):
+    # a button press always redraws the panel
+    refreshes.request(
+        "button " + LABELS[BUTTONS.index(pin)],
+        True,
+        functools.partial(applyButton, pin),
+    )
 
 
 # Loop through out buttons and attach the "handle_button" function to each
@@ -89,8 +119,15 @@ def handle_button(pin):
 for pin in BUTTONS:
     GPIO.add_event_detect(pin, GPIO.FALLING, handle_button, bouncetime=250)
 
-# schedule.every(2).minutes.do(refreshScreen)
-schedule.every().hour.at(":01").do(refreshScreen)
+# the render service plans the next refresh after every refresh, more often
+# with an alert or rain coming, less at night and within the API budget
+# (budget.py). The first one is at :01 of the next hour.
+def checkRefresh():
+    if getService().takeDueRefresh():
+        refreshes.request("schedule", delay=0)
+
+
+schedule.every(10).seconds.do(checkRefresh)
 
 while True:
     schedule.run_pending()
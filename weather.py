@@ -2,32 +2,46 @@
 import os
 import platform
 import logging
+import functools
+import hashlib
 import math
 import time
-from datetime import datetime
-import re
+import threading
 from enum import Enum
 
-import requests
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 
-import gpiod
-from inky.inky_uc8159 import (
-    BLACK,
-    WHITE,
-    GREEN,
-    RED,
-    YELLOW,
-    ORANGE,
-    BLUE,
-    DESATURATED_PALETTE as color_palette,
-)
-
-# the auto setup does for some reason do not work on some
-# raspberries - so using the explicit imports
-# from inky.auto import auto
-from inky import Inky7Colour as Inky_Impressions_57
-from inky import Inky_Impressions_7 as Inky_Impressions_73
+import alerts
+import budget
+import display
+import fetcher
+import quantize
+import regions
+import state
+import textmeasure
+import timeindex
+import timing
+
+# color indexes and palette of inky.inky_uc8159, defined here so drawing does
+# not need to import the display driver(see display.py)
+BLACK = 0
+WHITE = 1
+GREEN = 2
+BLUE = 3
+RED = 4
+YELLOW = 5
+ORANGE = 6
+color_palette = [
+    [0, 0, 0],  # Black
+    [255, 255, 255],  # White
+    [0, 255, 0],  # Green
+    [0, 0, 255],  # Blue
+    [255, 0, 0],  # Red
+    [255, 255, 0],  # Yellow
+    [255, 140, 0],  # Orange
+    [255, 255, 255],  # Clear
+]
 
 
 DEBUG = bool(os.environ.get('DEBUG'))
@@ -40,10 +54,20 @@ tmpfs_path = "/tmp/" if platform.system() == "Darwin" else "/dev/shm/"
 # font file path(Adjust or change whatever you want)
 if not os.environ.get('WI_DIR'):
     raise TypeError('Missing WI_DIR ENVIRONMENT variable')
+# where the script was started, paths given on the command line are relative
+# to it and not to WI_DIR
+launch_dir = os.getcwd()
 os.chdir(r"{}".format(os.environ.get('WI_DIR')))
 project_root = os.getcwd()
 
+api_base_default = "https://api.openweathermap.org"
+
 unit_imperial = "imperial"
+# the API is always asked for metric values, TEMP_UNIT is applied locally so
+# a unit toggle shares the cached response and needs no network at all
+unit_canonical = "metric"
+temperature_keys = ("temp", "feels_like", "dew_point")
+wind_keys = ("wind_speed", "wind_gust")
 
 colorMap = {
     "01d": ORANGE,  # clear sky
@@ -154,6 +178,13 @@ def getTranslation(lang, value):
             return value
 
 
+# translated (date, weekday) of the header for a local day
+@functools.lru_cache(maxsize=16)
+def getDateHeader(day, lang):
+    month, dayOfMonth, weekDay = timeindex.getDateLabels(day)
+    return getTranslation(lang, month) + " " + dayOfMonth, getTranslation(lang, weekDay)
+
+
 def getCanvasSize(inky_type):
     if inky_type == "57":
         return (600, 448)
@@ -180,10 +211,13 @@ def getGraphSize(inky_type):
     else:
         raise TypeError("Invalid Inky Type")
 
-def getURIByType(endpoint, lat, lon, api_key, unit):
+# api_base : where the API is asked, API_BASE in config.txt can point it to a
+#            stand-in serving recorded responses (see server.py)
+def getURIByType(endpoint, lat, lon, api_key, unit, api_base=api_base_default):
     if endpoint == "onecall":
         return (
-            "https://api.openweathermap.org/data/3.0/onecall?&lat="
+            api_base
+            + "/data/3.0/onecall?&lat="
             + lat
             + "&lon="
             + lon
@@ -195,7 +229,8 @@ def getURIByType(endpoint, lat, lon, api_key, unit):
         )
     elif endpoint == "rain":
         return (
-            "https://api.openweathermap.org/data/2.5/forecast?lat="
+            api_base
+            + "/data/2.5/forecast?lat="
             + lat
             + "&lon="
             + lon
@@ -208,25 +243,171 @@ def getURIByType(endpoint, lat, lon, api_key, unit):
     else:
         raise TypeError("Invalid URI endpoint")
 
+# return a copy of the onecall payload with temperatures(and wind) in unit,
+# every field is converted in one vectorised pass over current + hourly.
+def convertUnits(weatherInfo, unit):
+    if unit != unit_imperial:
+        return weatherInfo
+
+    converted = dict(weatherInfo)
+    records = []
+    if "current" in weatherInfo:
+        converted["current"] = dict(weatherInfo["current"])
+        records.append(converted["current"])
+    if "hourly" in weatherInfo:
+        converted["hourly"] = [dict(hour) for hour in weatherInfo["hourly"]]
+        records.extend(converted["hourly"])
+
+    # celsius -> fahrenheit, m/s -> mph
+    conversions = ((temperature_keys, 1.8, 32.0), (wind_keys, 2.236936, 0.0))
+    for keys, scale, offset in conversions:
+        for key in keys:
+            rows = [record for record in records if key in record]
+            if len(rows) == 0:
+                continue
+            values = np.fromiter(
+                (row[key] for row in rows), dtype=float, count=len(rows)
+            )
+            for row, value in zip(rows, (values * scale + offset).tolist()):
+                row[key] = value
+    return converted
+
+
+# {endpoint: uri} of the requests weatherInfomation makes for a config, the
+# rain forecast is only needed for the mode 2 rain graph
+def getRequestURIs(config):
+    lat = config.get("openweathermap", "LAT", raw=False)
+    lon = config.get("openweathermap", "LON", raw=False)
+    api_key = config.get("openweathermap", "API_KEY", raw=False)
+    api_base = config.get("openweathermap", "API_BASE", fallback=api_base_default)
+    uris = {
+        "onecall": getURIByType("onecall", lat, lon, api_key, unit_canonical, api_base)
+    }
+    if config.get("openweathermap", "MODE2_RAIN") == "true":
+        uris["rain"] = getURIByType("rain", lat, lon, api_key, unit_canonical, api_base)
+    return uris
+
+
+# {endpoint: seconds} a fetched response is reused before asking the API again
+def getCacheTTLs(config):
+    return {
+        "onecall": config.getint("openweathermap", "CACHE_TTL_ONECALL", fallback=600),
+        "rain": config.getint("openweathermap", "CACHE_TTL_RAIN", fallback=1800),
+    }
+
+
+def getResponseCache(config):
+    return fetcher.responseCache(tmpfs_path, getCacheTTLs(config))
+
+
+# calls per endpoint and day, see budget.py
+def getAPIBudget(config):
+    return budget.apiBudget(
+        tmpfs_path + "weather-impression-budget.json",
+        {
+            "onecall": config.getint(
+                "openweathermap", "BUDGET_ONECALL", fallback=budget.DEFAULT_DAILY_LIMIT
+            ),
+            "rain": config.getint(
+                "openweathermap", "BUDGET_RAIN", fallback=budget.DEFAULT_DAILY_LIMIT
+            ),
+        },
+    )
+
+
 def getRangeNumber(idx):
     # based on 3h forecast for rain
     # returns the next idx only every 3rd time
-    return math.floor(idx / 3)
+    # (works on a single hour as well as on an array of hours)
+    return idx // 3
+
+
+# hourly forecast as contiguous columns, built once per fetch and shared by
+# all modes. icon and description are small codes into the icons and
+# descriptions tables.
+class forecastData(object):
+    def __init__(self, weatherInfo, weatherInfoRain=None):
+        hourly = weatherInfo.get("hourly", [])
+        count = len(hourly)
+
+        def column(key, dtype=np.float64):
+            return np.fromiter((hour[key] for hour in hourly), dtype=dtype, count=count)
+
+        self.dt = column("dt", np.int64)
+        # local time of the location, see timeindex.py
+        self.timezone_offset = weatherInfo.get("timezone_offset", 0)
+        self.local = timeindex.localTimes(
+            self.dt,
+            timeindex.getOffsets(
+                self.dt, self.timezone_offset, weatherInfo.get("timezone")
+            ),
+        )
+        self.temp = column("temp")
+        self.feels_like = column("feels_like")
+        self.humidity = column("humidity")
+        self.pressure = column("pressure")
 
+        icons, icon = np.unique(
+            [hour["weather"][0]["icon"] for hour in hourly], return_inverse=True
+        )
+        self.icons = tuple(icons.tolist())
+        self.icon = icon.astype(np.uint8)
+        descriptions, description = np.unique(
+            [hour["weather"][0]["description"] for hour in hourly], return_inverse=True
+        )
+        self.descriptions = tuple(descriptions.tolist())
+        self.description = description.astype(np.uint8)
+
+        # the 3h rain forecast spread over the hours it covers, rain_hours is
+        # the number of hours both forecasts have in common.
+        self.rain = np.zeros(count)
+        self.rain_hours = count
+        if weatherInfoRain is not None:
+            entries = weatherInfoRain["list"]
+            rain3h = np.fromiter(
+                (entry.get("rain", {}).get("3h", 0.0) for entry in entries),
+                dtype=np.float64,
+            )
+            self.rain_hours = min(count, 3 * len(rain3h))
+            self.rain[: self.rain_hours] = rain3h[
+                getRangeNumber(np.arange(self.rain_hours))
+            ]
+
+    def __len__(self):
+        return len(self.dt)
+
+    def getIcon(self, idx):
+        return self.icons[self.icon[idx]]
 
-# empty structure
-class forecastInfo:
-    pass
+    def getDescription(self, idx):
+        return self.descriptions[self.description[idx]]
+
+
+# inky | png | null, DEBUG never touches the hardware
+def getDisplayName(config):
+    name = config.get(
+        "openweathermap", "DISPLAY", fallback="null" if DEBUG else "inky"
+    )
+    if DEBUG and name == "inky":
+        return "null"
+    return name
 
 
 class weatherInfomation(object):
-    def __init__(self):
+    # config : parsed configuration, config.txt is loaded when None
+    # fetch : function {name: uri} -> {name: json} used instead of the API,
+    #         e.g. fetcher.getFixtureFetch to replay recorded responses
+    def __init__(self, config=None, fetch=None):
         # load configuration from config.txt using configparser
         import configparser
 
-        self.config = configparser.ConfigParser()
+        self.config_from_file = config is None
+        self.config = configparser.ConfigParser() if config is None else config
+        self.fetch = fetch
         try:
-            self.config.read_file(open(project_root + "/config.txt"))
+            if self.config_from_file:
+                with timing.span("config"):
+                    self.config.read_file(open(project_root + "/config.txt"))
             self.lat = self.config.get("openweathermap", "LAT", raw=False)
             self.lon = self.config.get("openweathermap", "LON", raw=False)
             self.mode = self.config.get("openweathermap", "mode", raw=False)
@@ -247,14 +428,31 @@ class weatherInfomation(object):
             self.inky_size = self.config.get("openweathermap", "INKY_SIZE")
             self.mode2_rain = self.config.get("openweathermap", "MODE2_RAIN")
             self.mode2_pressure = self.config.get("openweathermap", "MODE2_PRESSURE")
+            self.mode2_graph = self.config.get(
+                "openweathermap", "MODE2_GRAPH", fallback="matplotlib"
+            )
+            # driver | pil, who maps the canvas to the panel colours
+            self.quantize = self.config.get(
+                "openweathermap", "QUANTIZE", fallback="driver"
+            )
+            # RGB | P, P draws with the panel colour indices from the start
+            self.canvas_mode = self.config.get(
+                "openweathermap", "CANVAS_MODE", fallback="RGB"
+            )
+            self.display = getDisplayName(self.config)
+
+            self.cache = getResponseCache(self.config)
 
             # api uri handling & data-fetching
             # API documentation at:
             #   onecall: https://openweathermap.org/api/one-call-api
             #   forecast: https://openweathermap.org/forecast5
-            self.forecast_api_uri_onecall = getURIByType("onecall", self.lat, self.lon, self.api_key, self.unit)
+            self.budget = getAPIBudget(self.config)
+
+            uris = getRequestURIs(self.config)
+            self.forecast_api_uri_onecall = uris["onecall"]
             if self.mode2_rain == 'true':
-                self.forecast_api_uri_rain = getURIByType("rain", self.lat, self.lon, self.api_key, self.unit)
+                self.forecast_api_uri_rain = uris["rain"]
 
             self.loadWeatherData(True if self.mode2_rain == 'true' else False)
         except:
@@ -265,26 +463,34 @@ class weatherInfomation(object):
             )
             return
 
-        # load one time messge and remove it from the file. one_time_message can be None.
+        # load one time messge. one_time_message can be None.
+        # it is cleared in the state store (state.py) once shown, config.txt
+        # is never rewritten here.
         try:
             self.one_time_message = self.config.get(
                 "openweathermap", "one_time_message", raw=False
             )
-            self.config.set("openweathermap", "one_time_message", "")
-            # remove it.
-            with open(project_root + "/config.txt", "w") as configfile:
-                self.config.write(configfile)
         except:
             self.one_time_message = ""
             pass
 
     def loadWeatherData(self, load_rain=False):
-        logging.info('Request weather info START')
-
-        self.weatherInfo = requests.get(self.forecast_api_uri_onecall).json()
+        # both endpoints are requested concurrently over the shared session
+        uris = {"onecall": self.forecast_api_uri_onecall}
         if load_rain is True:
-            self.weatherInfoRain = requests.get(self.forecast_api_uri_rain).json()
-        logging.info('Request weather info END')
+            uris["rain"] = self.forecast_api_uri_rain
+        with timing.span("fetch"):
+            if self.fetch is not None:
+                responses = self.fetch(uris)
+            else:
+                responses = fetcher.fetchAll(uris, cache=self.cache, budget=self.budget)
+
+        self.weatherInfo = convertUnits(responses["onecall"], self.unit)
+        if load_rain is True:
+            self.weatherInfoRain = responses["rain"]
+        self.forecast = forecastData(
+            self.weatherInfo, self.weatherInfoRain if load_rain is True else None
+        )
 
 
 class fonts(Enum):
@@ -294,10 +500,47 @@ class fonts(Enum):
     icon = project_root + "/fonts/weathericons-regular-webfont.ttf"
 
 
-def getFont(type, fontsize=12):
+# font faces are parsed once per process and shared between draw calls and
+# refreshes, keyed by (fonts member, size).
+@functools.lru_cache(maxsize=32)
+def loadFont(type, fontsize):
     return ImageFont.truetype(type.value, fontsize)
 
 
+def getFont(type, fontsize=12):
+    return loadFont(type, fontsize)
+
+
+# faces and sizes used by drawWeather
+fontPreload = (
+    (fonts.normal, 12),
+    (fonts.normal, 14),
+    (fonts.normal, 16),
+    (fonts.normal, 18),
+    (fonts.normal, 22),
+    (fonts.normal, 50),
+    (fonts.normal, 64),
+    (fonts.normal, 120),
+    (fonts.light, 24),
+    (fonts.icon, 12),
+    (fonts.icon, 50),
+    (fonts.icon, 80),
+    (fonts.icon, 90),
+    (fonts.icon, 130),
+    (fonts.icon, 160),
+)
+
+
+def warmFonts():
+    for type, fontsize in fontPreload:
+        getFont(type, fontsize)
+
+
+# hits/misses/currsize of the font cache, for profiling
+def getFontCacheInfo():
+    return loadFont.cache_info()
+
+
 def getFontColor(temp, wi):
     if temp < wi.cold_temp:
         return (0, 0, 255)
@@ -334,8 +577,260 @@ def getGraphColor(color):
     return (r, g, b)
 
 
+# file-like target for savefig(format="rgba"), matplotlib hands over the
+# Agg renderer buffer as a (height, width, 4) memoryview which PIL maps as is.
+class rgbaBufferSink(object):
+    image = None
+
+    def seek(self, *args):
+        return 0
+
+    def write(self, data):
+        height, width, _ = data.shape
+        self.image = Image.frombuffer(
+            "RGBA", (width, height), data, "raw", "RGBA", 0, 1
+        )
+
+
+# rasterise a figure exactly like savefig(bbox_inches="tight", transparent=True)
+# to a png would, without the png codec and the round-trip through tmpfs.
+def figureToImage(fig):
+    sink = rgbaBufferSink()
+    fig.savefig(sink, format="rgba", bbox_inches="tight", transparent=True)
+    return sink.image
+
+
+# matplotlib figure that is created once and redrawn on every refresh, only
+# the line data and the per-refresh artists(markers, labels) are replaced.
+class graphFigure(object):
+    def __init__(self, graph_size, styles, name="graph"):
+        import matplotlib
+
+        # never pick up an interactive backend in the long running watcher
+        matplotlib.use("Agg")
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        graph_height, graph_width = graph_size
+        # not registered with pyplot, so nothing keeps old figures alive
+        self.figure = Figure(figsize=(graph_width, graph_height))
+        FigureCanvasAgg(self.figure)
+        self.name = name
+        self.axes = self.figure.add_subplot()
+        self.axes.axis("off")
+        self.lines = [self.axes.plot([], [], **style)[0] for style in styles]
+        self.artists = []
+
+    def update(self, data, xlim=None, ylim=None):
+        for artist in self.artists:
+            artist.remove()
+        self.artists = []
+        for line, (x, y) in zip(self.lines, data):
+            line.set_data(x, y)
+        self.axes.relim()
+        self.axes.autoscale_view()
+        if xlim is not None:
+            self.axes.set_xlim(*xlim)
+        if ylim is not None:
+            self.axes.set_ylim(*ylim)
+
+    def axvline(self, *args, **kwargs):
+        self.artists.append(self.axes.axvline(*args, **kwargs))
+
+    def text(self, *args, **kwargs):
+        self.artists.append(self.axes.text(*args, **kwargs))
+
+    def toImage(self):
+        with timing.span("graph." + self.name):
+            return figureToImage(self.figure)
+
+
+# pool of graph figures keyed by graph name and size
+graphFigures = {}
+
+
+def getGraphFigure(name, graph_size, styles):
+    key = (name, graph_size)
+    if key not in graphFigures:
+        graphFigures[key] = graphFigure(graph_size, styles, name)
+    return graphFigures[key]
+
+
+# the parts of a frame that only depend on mode, language, panel size, unit
+# and the mode 2 flags : captions, the mode 2 legend and the mode 3 icons.
+# they are drawn once into a cached layer, see getStaticLayer
+def drawStaticLayer(wi, cv):
+    draw = ImageDraw.Draw(cv)
+    width, height = cv.size
+    if hasattr(wi, "weatherInfo") is False:
+        return
+
+    offsetX = 10
+    offsetY = 40
+
+    draw.text(
+        (5 + offsetX, 35 + offsetY),
+        getTranslation(wi.lang, "Temperature"),
+        getDisplayColor(BLACK),
+        font=getFont(fonts.light, fontsize=24),
+    )
+    draw.text(
+        (5 + offsetX, 175 + 40),
+        getTranslation(wi.lang, "Feels like"),
+        getDisplayColor(BLACK),
+        font=getFont(fonts.light, fontsize=24),
+    )
+
+    offsetY = 210
+
+    if wi.mode == "2":
+        # mode 2 legend
+        presure_offset = 135 if wi.mode2_pressure == "true" else 0
+        # label.pressure
+        if wi.mode2_pressure == "true":
+            draw.rectangle((10, 460, 25, 476), fill=getDisplayColor(RED))
+            draw.text(
+                (20 + offsetX, 458),
+                getTranslation(wi.lang, "Pressure"),
+                getDisplayColor(BLACK),
+                font=getFont(fonts.normal, fontsize=16),
+            )
+
+        # label.temp
+        draw.rectangle((10 + presure_offset, 460, 25 + presure_offset, 476), fill=getDisplayColor(ORANGE))
+        draw.text(
+            (20 + offsetX + presure_offset, 458),
+            getTranslation(wi.lang, "Temp"),
+            getDisplayColor(BLACK),
+            font=getFont(fonts.normal, fontsize=16),
+        )
+
+        # label.feels-like
+        draw.rectangle((145 + presure_offset, 460, 160 + presure_offset, 476), fill=getDisplayColor(GREEN))
+        draw.text(
+            (155 + offsetX + presure_offset, 458),
+            getTranslation(wi.lang, "Feels like"),
+            getDisplayColor(BLACK),
+            font=getFont(fonts.normal, fontsize=16),
+        )
+
+        # label.rain
+        if wi.mode2_rain == "true":
+            draw.rectangle((280 + presure_offset, 460, 295 + presure_offset, 476), fill=getDisplayColor(BLUE))
+            draw.text(
+                (290 + offsetX + presure_offset, 458),
+                getTranslation(wi.lang, "Rain"),
+                getDisplayColor(BLACK),
+                font=getFont(fonts.normal, fontsize=16),
+            )
+
+    if wi.mode == "3":
+        columnWidth = width / 2
+        textColor = (50, 50, 50)
+        # center = column width / 2 - (text_width * .5)
+        sunrise_width, _ = textmeasure.getSize(
+            getFont(fonts.normal, fontsize=16), "Sunrise"
+        )
+        sunriseXOffset = (columnWidth / 2) - (sunrise_width * 0.5)
+
+        sunriseIcon_width, _ = textmeasure.getSize(
+            getFont(fonts.icon, fontsize=90), iconMap["sunrise"]
+        )
+        sunriseIconXOffset = (columnWidth / 2) - (sunriseIcon_width * 0.5)
+
+        draw.text(
+            (sunriseIconXOffset, offsetY + 90),
+            iconMap["sunrise"],
+            getDisplayColor(colorMap["sunrise"]),
+            anchor="la",
+            font=getFont(fonts.icon, fontsize=90),
+        )
+        draw.text(
+            (sunriseXOffset, offsetY + 200),
+            "Sunrise",
+            textColor,
+            anchor="la",
+            font=getFont(fonts.normal, fontsize=16),
+        )
+
+        sunset_width, _ = textmeasure.getSize(
+            getFont(fonts.normal, fontsize=16), "Sunset"
+        )
+        sunsetXOffset = columnWidth + (columnWidth / 2) - (sunset_width * 0.5)
+
+        sunsetIcon_width, _ = textmeasure.getSize(
+            getFont(fonts.icon, fontsize=90), iconMap["sunset"]
+        )
+        sunsetIconXOffset = columnWidth + (columnWidth / 2) - (sunsetIcon_width * 0.5)
+
+        draw.text(
+            (sunsetIconXOffset, offsetY + 90),
+            iconMap["sunset"],
+            getDisplayColor(colorMap["sunset"]),
+            anchor="la",
+            font=getFont(fonts.icon, fontsize=90),
+        )
+        draw.text(
+            (sunsetXOffset, offsetY + 200),
+            "Sunset",
+            textColor,
+            anchor="la",
+            font=getFont(fonts.normal, fontsize=16),
+        )
+
+
+# RGB canvas, or with CANVAS_MODE=P one indexed by panel colour (a third of
+# the memory, and nothing left to quantise for the driver)
+def newCanvas(wi):
+    size = getCanvasSize(wi.inky_size)
+    if getattr(wi, "canvas_mode", "RGB") == "P":
+        return quantize.newCanvas(size, WHITE)
+    return Image.new("RGB", size, getDisplayColor(WHITE))
+
+
+# paste a RGBA graph image, mapped to the panel colours on a P canvas
+def pasteGraph(cv, graphImage, position):
+    if cv.mode == "P":
+        quantize.pasteImage(cv, graphImage, position, saturation)
+    else:
+        cv.paste(graphImage, position, graphImage)
+
+
+# static layers keyed by getStaticLayerKey, a handful at most (modes, units)
+staticLayers = {}
+maxStaticLayers = 8
+
+
+def getStaticLayerKey(wi):
+    return (
+        wi.inky_size,
+        wi.mode,
+        wi.lang,
+        wi.unit,
+        wi.mode2_pressure,
+        wi.mode2_rain,
+        wi.canvas_mode,
+    )
+
+
+def getStaticLayer(wi):
+    key = getStaticLayerKey(wi)
+    if key not in staticLayers:
+        with timing.span("static layer"):
+            layer = newCanvas(wi)
+            drawStaticLayer(wi, layer)
+        if len(staticLayers) >= maxStaticLayers:
+            # drop the oldest one
+            del staticLayers[next(iter(staticLayers))]
+        staticLayers[key] = layer
+    return staticLayers[key]
+
+
 # draw current weather and forecast into canvas
-def drawWeather(wi, cv):
+# static_layer : the static parts are already on cv (getStaticLayer)
+def drawWeather(wi, cv, static_layer=False):
+    if static_layer is False:
+        drawStaticLayer(wi, cv)
     draw = ImageDraw.Draw(cv)
     width, height = cv.size
 
@@ -380,22 +875,21 @@ def drawWeather(wi, cv):
     pressure = wi.weatherInfo["current"]["pressure"]
     epoch = int(wi.weatherInfo["current"]["dt"])
     # snow = wi.weatherInfo[u'current'][u'snow']
-    # dateString = time.strftime("%B %-d", time.localtime(epoch))
-    monthString = time.strftime("%B", time.localtime(epoch))
-    dayString = time.strftime("%-d", time.localtime(epoch))
-    weekDayString = time.strftime("%a", time.localtime(epoch))
-    time.strftime("%w", time.localtime(epoch))
+    timezoneOffset = wi.forecast.timezone_offset
+    dateString, weekDayString = getDateHeader(
+        timeindex.getLocalTime(epoch, timezoneOffset)[0], wi.lang
+    )
 
     # date
     draw.text(
         (15, 5),
-        getTranslation(wi.lang, monthString) + " " + dayString,
+        dateString,
         getDisplayColor(BLACK),
         font=getFont(fonts.normal, fontsize=64),
     )
     draw.text(
         (width - 8, 5),
-        getTranslation(wi.lang, weekDayString),
+        weekDayString,
         getDisplayColor(BLACK),
         anchor="ra",
         font=getFont(fonts.normal, fontsize=64),
@@ -406,18 +900,12 @@ def drawWeather(wi, cv):
 
     # Draw temperature string
     tempOffset = 20
-    temperatureTextWidth = draw.textlength(
-        getTempretureString(temp_cur), font=getFont(fonts.normal, fontsize=120)
+    temperatureTextWidth = textmeasure.getLength(
+        getFont(fonts.normal, fontsize=120), getTempretureString(temp_cur)
     )
     if temperatureTextWidth < 71:
         # when the temp string is a bit short.
         tempOffset = 45
-    draw.text(
-        (5 + offsetX, 35 + offsetY),
-        getTranslation(wi.lang, "Temperature"),
-        getDisplayColor(BLACK),
-        font=getFont(fonts.light, fontsize=24),
-    )
     draw.text(
         (tempOffset + offsetX, 50 + offsetY),
         getTempretureString(temp_cur),
@@ -451,20 +939,14 @@ def drawWeather(wi, cv):
     )
 
     # feels like
-    draw.text(
-        (5 + offsetX, 175 + 40),
-        getTranslation(wi.lang, "Feels like"),
-        getDisplayColor(BLACK),
-        font=getFont(fonts.light, fontsize=24),
-    )
     draw.text(
         (10 + offsetX, 200 + 40),
         getTempretureString(temp_cur_feels),
         getFontColor(temp_cur_feels, wi),
         font=getFont(fonts.normal, fontsize=50),
     )
-    feelslikeTextWidth = draw.textlength(
-        getTempretureString(temp_cur_feels), font=getFont(fonts.normal, fontsize=50)
+    feelslikeTextWidth = textmeasure.getLength(
+        getFont(fonts.normal, fontsize=50), getTempretureString(temp_cur_feels)
     )
     draw.text(
         (feelslikeTextWidth + 20 + offsetX, 200 + 40),
@@ -487,8 +969,8 @@ def drawWeather(wi, cv):
         getDisplayColor(BLACK),
         font=getFont(fonts.normal, fontsize=50),
     )
-    pressureTextWidth = draw.textlength(
-        "%d" % pressure, font=getFont(fonts.normal, fontsize=50)
+    pressureTextWidth = textmeasure.getLength(
+        getFont(fonts.normal, fontsize=50), "%d" % pressure
     )
     draw.text(
         (feelslikeTextWidth + pressureTextWidth + 95 + offsetX, 224 + 40),
@@ -502,94 +984,73 @@ def drawWeather(wi, cv):
     # MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1
     # MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1 MODE 1
     # When alerts are in effect, show it to forecast area.
-    if wi.mode == "1" and "alerts" in wi.weatherInfo:
-        alertInEffectString = time.strftime(
-            "%B %-d, %H:%m %p", time.localtime(wi.weatherInfo["alerts"][0]["start"])
+    if wi.mode == "1" and len(wi.weatherInfo.get("alerts", [])) > 0:
+        # the description is wrapped to the area below the header, see alerts.py
+        descFont = getFont(fonts.normal, fontsize=14)
+        descTop = 270
+        lineHeight = textmeasure.getLineHeight(descFont)
+        pages = alerts.getAlertPages(
+            wi.weatherInfo["alerts"],
+            descFont,
+            width - 10 - (5 + offsetX),
+            int((height - 5 - descTop) // lineHeight),
         )
+        pageIndex = alerts.getPageIndex(pages, epoch)
+        alert, lines = pages[pageIndex]
 
-        # remove "\n###\n" and \n\n
-        desc = wi.weatherInfo["alerts"][0]["description"].replace("\n###\n", "")
-        desc = desc.replace("\n\n", "")
-        desc = desc.replace("https://", "")  # remove https://
-        desc = re.sub(r"([A-Za-z]*:)", "\n\g<1>", desc)
-        desc = re.sub(r"((?=.{90})(.{0,89}([\.[ ]|[ ]))|.{0,89})", "\g<1>\n", desc)
-        desc = desc.replace("\n\n", "")
+        alertInEffectString = timeindex.getDateTimeLabel(alert["start"], timezoneOffset)
+        senderString = alertInEffectString + "/" + alert["sender_name"]
+        if len(pages) > 1:
+            senderString += "  (%d/%d)" % (pageIndex + 1, len(pages))
 
         draw.text(
             (5 + offsetX, 215),
-            wi.weatherInfo["alerts"][0]["event"].capitalize(),
+            alert["event"].capitalize(),
             getDisplayColor(RED),
             anchor="la",
             font=getFont(fonts.light, fontsize=24),
         )
         draw.text(
             (5 + offsetX, 240),
-            alertInEffectString + "/" + wi.weatherInfo["alerts"][0]["sender_name"],
+            senderString,
             getDisplayColor(BLACK),
             font=getFont(fonts.normal, fontsize=12),
         )
 
-        draw.text(
-            (5 + offsetX, 270),
-            desc,
-            getDisplayColor(RED),
-            anchor="la",
-            font=getFont(fonts.normal, fontsize=14),
-        )
+        for i, line in enumerate(lines):
+            draw.text(
+                (5 + offsetX, descTop + i * lineHeight),
+                line,
+                getDisplayColor(RED),
+                anchor="la",
+                font=descFont,
+            )
         return
 
     # MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2
     # MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2 MODE 2
     # Graph mode
     if wi.mode == "2":
-        import matplotlib.pyplot as plt
-        from matplotlib import font_manager as fm
-        import numpy as np
-
         forecastRange = 47
         graph_size = getGraphSize(wi.inky_size)
         graph_height = graph_size[0]
         graph_width = graph_size[1]
-        xarray = []
-        tempArray = []
-        feelsArray = []
-        pressureArray = []
-        rainArray = []
-
-        # "weather": [
-        #     {
-        #         "id": 500,
-        #         "main": "Rain",
-        #         "description": "light rain",
-        #         "icon": "10n"
-        #     }
-        # ],
 
-        try:
-            for fi in range(forecastRange):
-                finfo = forecastInfo()
-                finfo.time_dt = wi.weatherInfo["hourly"][fi]["dt"]
-                finfo.time = time.strftime("%-I %p", time.localtime(finfo.time_dt))
-                finfo.temp = wi.weatherInfo["hourly"][fi]["temp"]
-                finfo.feels_like = wi.weatherInfo["hourly"][fi]["feels_like"]
-                finfo.humidity = wi.weatherInfo["hourly"][fi]["humidity"]
-                finfo.pressure = wi.weatherInfo["hourly"][fi]["pressure"]
-                if wi.mode2_rain == 'true':
-                    finfo.rain = wi.weatherInfoRain["list"][getRangeNumber(fi)].get("rain", { "3h": 0.0 })
-                else:
-                    finfo.rain = { "3h": 0.0 }
-                finfo.icon = wi.weatherInfo["hourly"][fi]["weather"][0]["icon"]
-                # print(wi.weatherInfo[u'hourly'][fi][u'snow'][u'1h']) # mm  / you may get 8 hours maximum
-                
-                xarray.append(finfo.time_dt)
-                tempArray.append(finfo.temp)
-                feelsArray.append(finfo.feels_like)
-                pressureArray.append(finfo.pressure)
-                rainArray.append(finfo.rain["3h"])
-        except IndexError:
+        # the first 47 hours, as far as the hourly and the rain forecast go
+        forecast = wi.forecast
+        count = min(forecastRange, len(forecast))
+        if wi.mode2_rain == "true":
+            count = min(count, forecast.rain_hours)
+        xarray = forecast.dt[:count]
+        tempArray = forecast.temp[:count]
+        feelsArray = forecast.feels_like[:count]
+        pressureArray = forecast.pressure[:count]
+        rainArray = forecast.rain[:count]
+
+        if count < forecastRange:
             # The weather forecast API is supposed to return 48 forecasts, but it may return fewer than 48.
             errorMessage = (
-                "Weather API returns limited hourly forecast(" + str(len(xarray)) + ")"
+                "Weather API returns limited hourly forecast(" + str(count) + ")"
             )
             draw.text(
                 (width - 10, height - 2),
@@ -598,114 +1059,91 @@ def drawWeather(wi, cv):
                 anchor="ra",
                 font=getFont(fonts.normal, fontsize=12),
             )
-            pass
-          
+
         if wi.mode2_pressure == "true":
-            # graph-pressure
-            fig = plt.figure()
-            fig.set_figheight(graph_height)
-            fig.set_figwidth(graph_width)
-            plt.plot(
-                xarray, pressureArray, linewidth=3, color=getGraphColor(RED)
-            )  # RGB in 0~1.0
-            # plt.plot(xarray, pressureArray)
-            # annot_max(np.array(xarray),np.array(tempArray))
-            # annot_max(np.array(xarray),np.array(pressureArray))
-            plt.axis("off")
-            plt.gca()
             airPressureMin = 990
             airPressureMax = 1020
-            if min(pressureArray) < airPressureMin - 2:
-                airPressureMin = min(pressureArray) + 2
-            if max(pressureArray) > airPressureMax - 2:
-                airPressureMax = max(pressureArray) + 2
-
-            plt.ylim(airPressureMin, airPressureMax)
-
-            plt.savefig(tmpfs_path + "pressure.png", bbox_inches="tight", transparent=True)
-            tempGraphImage = Image.open(tmpfs_path + "pressure.png")
-            cv.paste(tempGraphImage, (-35, 330), tempGraphImage)
-
-        # draw temp and feels like in one figure
-        fig = plt.figure()
-        fig.set_figheight(graph_height)
-        fig.set_figwidth(graph_width)
-        plt.plot(
-            xarray, feelsArray, linewidth=3, color=getGraphColor(GREEN), linestyle=":"
-        )  # RGB in 0~1.0
-        plt.axis("off")
-        plt.plot(xarray, tempArray, linewidth=3, color=getGraphColor(ORANGE))
-
-        for idx in range(1, len(xarray)):
-            h = time.strftime("%-I", time.localtime(xarray[idx]))
-            if h == "0" or h == "12":
-                plt.axvline(x=xarray[idx], color="black", linestyle=":")
-                posY = np.array(tempArray).max() + 1
-                plt.text(
+            if pressureArray.min() < airPressureMin - 2:
+                airPressureMin = pressureArray.min() + 2
+            if pressureArray.max() > airPressureMax - 2:
+                airPressureMax = pressureArray.max() + 2
+
+        # midnight and noon markers, labeled with AM/PM left of the line
+        hours = forecast.local.hour[:count]
+        markers = []
+        for idx in (np.flatnonzero(hours[1:] % 12 == 0) + 1).tolist():
+            markers.append(
+                (
+                    xarray[idx],
                     xarray[idx - 1],
-                    posY,
-                    getTranslation(
-                        wi.lang, time.strftime("%p", time.localtime(xarray[idx]))
-                    ),
+                    getTranslation(wi.lang, timeindex.getMeridiem(hours[idx])),
                 )
-        plt.axis("off")
-        plt.savefig(tmpfs_path + "temp.png", bbox_inches="tight", transparent=True)
-        tempGraphImage = Image.open(tmpfs_path + "temp.png")
-        cv.paste(tempGraphImage, (-35, 300), tempGraphImage)
-
-        # rain
-        if wi.mode2_rain == "true":
-            fig = plt.figure()
-            fig.set_figheight(graph_height)
-            fig.set_figwidth(graph_width)
-            plt.plot(
-                xarray, rainArray, linewidth=3, color=getGraphColor(BLUE)
-            )  # RGB in 0~1.0
-            plt.axis("off")
-            plt.gca()
-            plt.savefig(tmpfs_path + "rain.png", bbox_inches="tight", transparent=True)
-            tempGraphImage = Image.open(tmpfs_path + "rain.png")
-            cv.paste(tempGraphImage, (-35, 320), tempGraphImage)
-
-        # draw labels
-        presure_offset = 135 if wi.mode2_pressure == "true" else 0
-        # label.pressure
-        if wi.mode2_pressure == "true":
-            draw.rectangle((10, 460, 25, 476), fill=getDisplayColor(RED))
-            draw.text(
-                (20 + offsetX, 458),
-                getTranslation(wi.lang, "Pressure"),
-                getDisplayColor(BLACK),
-                font=getFont(fonts.normal, fontsize=16),
             )
-
-        # label.temp
-        draw.rectangle((10 + presure_offset, 460, 25 + presure_offset, 476), fill=getDisplayColor(ORANGE))
-        draw.text(
-            (20 + offsetX + presure_offset, 458),
-            getTranslation(wi.lang, "Temp"),
-            getDisplayColor(BLACK),
-            font=getFont(fonts.normal, fontsize=16),
-        )
-
-        # label.feels-like
-        draw.rectangle((145 + presure_offset, 460, 160 + presure_offset, 476), fill=getDisplayColor(GREEN))
-        draw.text(
-            (155 + offsetX + presure_offset, 458),
-            getTranslation(wi.lang, "Feels like"),
-            getDisplayColor(BLACK),
-            font=getFont(fonts.normal, fontsize=16),
-        )
-        
-        # label.rain
-        if wi.mode2_rain == "true":
-            draw.rectangle((280 + presure_offset, 460, 295 + presure_offset, 476), fill=getDisplayColor(BLUE))
-            draw.text(
-                (290 + offsetX + presure_offset, 458),
-                getTranslation(wi.lang, "Rain"),
-                getDisplayColor(BLACK),
-                font=getFont(fonts.normal, fontsize=16),
+        posY = tempArray.max() + 1 if count > 0 else 0
+
+        if wi.mode2_graph == "native":
+            # same graphs drawn with ImageDraw, matplotlib is never imported
+            import pilgraph
+
+            if wi.mode2_pressure == "true":
+                graph = pilgraph.lineGraph(graph_size, (-35, 330), "pressure")
+                graph.plot(xarray, pressureArray, getDisplayColor(RED))
+                graph.setYLim(airPressureMin, airPressureMax)
+                graph.draw(draw)
+
+            graph = pilgraph.lineGraph(graph_size, (-35, 300), "temp")
+            graph.plot(xarray, feelsArray, getDisplayColor(GREEN), dotted=True)
+            graph.plot(xarray, tempArray, getDisplayColor(ORANGE))
+            for markerX, labelX, label in markers:
+                graph.axvline(markerX, getDisplayColor(BLACK))
+                graph.text(labelX, posY, label, getFont(fonts.normal, fontsize=12))
+            graph.draw(draw)
+
+            if wi.mode2_rain == "true":
+                graph = pilgraph.lineGraph(graph_size, (-35, 320), "rain")
+                graph.plot(xarray, rainArray, getDisplayColor(BLUE))
+                graph.draw(draw)
+        else:
+            if wi.mode2_pressure == "true":
+                # graph-pressure
+                graph = getGraphFigure(
+                    "pressure",
+                    graph_size,
+                    [dict(linewidth=3, color=getGraphColor(RED))],  # RGB in 0~1.0
+                )
+                graph.update(
+                    [(xarray, pressureArray)], ylim=(airPressureMin, airPressureMax)
+                )
+                tempGraphImage = graph.toImage()
+                pasteGraph(cv, tempGraphImage, (-35, 330))
+
+            # draw temp and feels like in one figure
+            graph = getGraphFigure(
+                "temp",
+                graph_size,
+                [
+                    dict(linewidth=3, color=getGraphColor(GREEN), linestyle=":"),
+                    dict(linewidth=3, color=getGraphColor(ORANGE)),
+                ],
             )
+            graph.update([(xarray, feelsArray), (xarray, tempArray)])
+            for markerX, labelX, label in markers:
+                graph.axvline(x=markerX, color="black", linestyle=":")
+                graph.text(labelX, posY, label)
+            tempGraphImage = graph.toImage()
+            pasteGraph(cv, tempGraphImage, (-35, 300))
+
+            # rain
+            if wi.mode2_rain == "true":
+                graph = getGraphFigure(
+                    "rain",
+                    graph_size,
+                    [dict(linewidth=3, color=getGraphColor(BLUE))],  # RGB in 0~1.0
+                )
+                graph.update([(xarray, rainArray)])
+                tempGraphImage = graph.toImage()
+                pasteGraph(cv, tempGraphImage, (-35, 320))
+
         return
 
     # MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3 MODE 3
@@ -715,28 +1153,24 @@ def drawWeather(wi, cv):
         sunrise = wi.weatherInfo["current"]["sunrise"]
         sunset = wi.weatherInfo["current"]["sunset"]
 
-        sunriseFormatted = datetime.fromtimestamp(sunrise).strftime("%#I:%M %p")
-        sunsetFormatted = datetime.fromtimestamp(sunset).strftime("%#I:%M %p")
+        sunriseFormatted = timeindex.getClockLabel(
+            *timeindex.getLocalTime(sunrise, timezoneOffset)[1:]
+        )
+        sunsetFormatted = timeindex.getClockLabel(
+            *timeindex.getLocalTime(sunset, timezoneOffset)[1:]
+        )
 
         # print([sunriseFormatted, sunsetFormatted])
 
         columnWidth = width / 2
         textColor = (50, 50, 50)
         # center = column width / 2 - (text_width * .5)
-        # measure sunrise
-        sunrise_width, _ = getFont(fonts.normal, fontsize=16).getsize("Sunrise")
-        sunriseXOffset = (columnWidth / 2) - (sunrise_width * 0.5)
-
-        sunriseFormatted_width, _ = getFont(fonts.normal, fontsize=12).getsize(
-            sunriseFormatted
+        # the icons and captions are in the static layer
+        sunriseFormatted_width, _ = textmeasure.getSize(
+            getFont(fonts.normal, fontsize=12), sunriseFormatted
         )
         sunriseFormattedXOffset = (columnWidth / 2) - (sunriseFormatted_width * 0.5)
 
-        sunriseIcon_width, _ = getFont(fonts.icon, fontsize=90).getsize(
-            iconMap["sunrise"]
-        )
-        sunriseIconXOffset = (columnWidth / 2) - (sunriseIcon_width * 0.5)
-
         draw.text(
             (sunriseFormattedXOffset, offsetY + 220),
             sunriseFormatted,
@@ -744,36 +1178,14 @@ def drawWeather(wi, cv):
             anchor="la",
             font=getFont(fonts.normal, fontsize=12),
         )
-        draw.text(
-            (sunriseIconXOffset, offsetY + 90),
-            iconMap["sunrise"],
-            getDisplayColor(colorMap["sunrise"]),
-            anchor="la",
-            font=getFont(fonts.icon, fontsize=90),
-        )
-        draw.text(
-            (sunriseXOffset, offsetY + 200),
-            "Sunrise",
-            textColor,
-            anchor="la",
-            font=getFont(fonts.normal, fontsize=16),
-        )
-
-        sunset_width, _ = getFont(fonts.normal, fontsize=16).getsize("sunset")
-        sunsetXOffset = columnWidth + (columnWidth / 2) - (sunset_width * 0.5)
 
-        sunsetFormatted_width, _ = getFont(fonts.normal, fontsize=12).getsize(
-            sunsetFormatted
+        sunsetFormatted_width, _ = textmeasure.getSize(
+            getFont(fonts.normal, fontsize=12), sunsetFormatted
         )
         sunsetFormattedXOffset = (
             columnWidth + (columnWidth / 2) - (sunsetFormatted_width * 0.5)
         )
 
-        sunsetIcon_width, _ = getFont(fonts.icon, fontsize=90).getsize(
-            iconMap["sunset"]
-        )
-        sunsetIconXOffset = columnWidth + (columnWidth / 2) - (sunsetIcon_width * 0.5)
-
         draw.text(
             (sunsetFormattedXOffset, offsetY + 220),
             sunsetFormatted,
@@ -781,36 +1193,14 @@ def drawWeather(wi, cv):
             anchor="la",
             font=getFont(fonts.normal, fontsize=12),
         )
-        draw.text(
-            (sunsetIconXOffset, offsetY + 90),
-            iconMap["sunset"],
-            getDisplayColor(colorMap["sunset"]),
-            anchor="la",
-            font=getFont(fonts.icon, fontsize=90),
-        )
-        draw.text(
-            (sunsetXOffset, offsetY + 200),
-            "Sunset",
-            textColor,
-            anchor="la",
-            font=getFont(fonts.normal, fontsize=16),
-        )
 
         return
 
     # MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4
     # MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4 MODE 4
     if wi.mode == "4":
-        import matplotlib.pyplot as plt
+        import matplotlib
         from matplotlib import font_manager as fm
-        import numpy as np
-
-        # import datetime
-
-        def minutes_since(timestamp):
-            dt = datetime.fromtimestamp(timestamp)
-            timestamp_minutes_since_midnight = dt.hour * 60 + dt.minute
-            return timestamp_minutes_since_midnight
 
         # icon font setup
         icon_font = getFont(fonts.icon, fontsize=12)
@@ -825,33 +1215,28 @@ def drawWeather(wi, cv):
         # y = [math.sin(math.pi * i / 12) for i in x]
         y = [math.cos((i / 12 - 1) * math.pi) for i in x]
 
-        fig = plt.figure()
-        fig.set_figheight(graph_height)
-        fig.set_figwidth(graph_width)
-
-        plt.xlim(0, 23)
-        plt.ylim(-1.2, 1.2)
-        # add labels and title
-        # plt.xlabel("Hour of Day")
-        # plt.ylabel("Sun Elevation")
-        plt.title("")
+        # the sun curve stays on top of the sunrise/sunset lines
+        graph = getGraphFigure(
+            "day",
+            (graph_height, graph_width),
+            [dict(linewidth=3, color=getGraphColor(RED), zorder=2.5)],  # RGB in 0~1.0
+        )
+        graph.update([(x, y)], xlim=(0, 23), ylim=(-1.2, 1.2))
 
         # add sunrise and sunset lines
         sunrise_timestamp = wi.weatherInfo["current"]["sunrise"]
         sunset_timestamp = wi.weatherInfo["current"]["sunset"]
-        sunrise_time = minutes_since(sunrise_timestamp)
-        sunset_time = minutes_since(sunset_timestamp)
+        sunrise_time = timeindex.getMinuteOfDay(sunrise_timestamp, timezoneOffset)
+        sunset_time = timeindex.getMinuteOfDay(sunset_timestamp, timezoneOffset)
         sunrise_hour = sunrise_time / 60
         sunset_hour = sunset_time / 60
-        sunriseFormatted = datetime.fromtimestamp(sunrise_timestamp).strftime(
-            "%#I:%M %p"
-        )
-        sunsetFormatted = datetime.fromtimestamp(sunset_timestamp).strftime("%#I:%M %p")
+        sunriseFormatted = timeindex.getClockLabel(*divmod(sunrise_time, 60))
+        sunsetFormatted = timeindex.getClockLabel(*divmod(sunset_time, 60))
 
-        plt.axvline(x=sunrise_hour, color="blue", linestyle="--")
-        plt.axvline(x=sunset_hour, color="blue", linestyle="--")
+        graph.axvline(x=sunrise_hour, color="blue", linestyle="--")
+        graph.axvline(x=sunset_hour, color="blue", linestyle="--")
 
-        plt.text(
+        graph.text(
             sunrise_hour - 0.35,
             1.35,
             iconMap["sunrise"],
@@ -860,7 +1245,7 @@ def drawWeather(wi, cv):
             va="top",
             color=getGraphColor(YELLOW),
         )
-        plt.text(
+        graph.text(
             sunrise_hour - 0.3,
             1.3,
             iconMap["sunrise"],
@@ -870,7 +1255,7 @@ def drawWeather(wi, cv):
             color=getGraphColor(BLUE),
         )
 
-        plt.text(
+        graph.text(
             sunset_hour + 0.35,
             1.35,
             iconMap["sunset"],
@@ -879,7 +1264,7 @@ def drawWeather(wi, cv):
             va="top",
             color=getGraphColor(YELLOW),
         )
-        plt.text(
+        graph.text(
             sunset_hour + 0.3,
             1.3,
             iconMap["sunset"],
@@ -888,7 +1273,7 @@ def drawWeather(wi, cv):
             va="top",
             color=getGraphColor(BLUE),
         )
-        plt.text(
+        graph.text(
             sunrise_hour - 0.3,
             0.8,
             sunriseFormatted,
@@ -898,7 +1283,7 @@ def drawWeather(wi, cv):
             rotation="horizontal",
             color=getGraphColor(BLUE),
         )
-        plt.text(
+        graph.text(
             sunset_hour + 0.3,
             0.8,
             sunsetFormatted,
@@ -910,67 +1295,45 @@ def drawWeather(wi, cv):
         )
 
         normal = getFont(fonts.normal, fontsize=12)
-        plt.rcParams["font.family"] = normal.getname()
+        matplotlib.rcParams["font.family"] = normal.getname()
 
-        plt.plot(x, y, linewidth=3, color=getGraphColor(RED))  # RGB in 0~1.0
-        # plt.plot(xarray, pressureArray)
-        # annot_max(np.array(xarray),np.array(tempArray))
-        # annot_max(np.array(xarray),np.array(pressureArray))
-        plt.axis("off")
-
-        plt.savefig(tmpfs_path + "day.png", bbox_inches="tight", transparent=True)
-        tempGraphImage = Image.open(tmpfs_path + "day.png")
-        cv.paste(tempGraphImage, (-35, 300), tempGraphImage)
+        tempGraphImage = graph.toImage()
+        pasteGraph(cv, tempGraphImage, (-35, 300))
 
         return
 
     forecastIntervalHours = int(wi.forecast_interval)
     forecastRange = 4
-    for fi in range(forecastRange):
-        finfo = forecastInfo()
-        finfo.time_dt = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["dt"]
-        finfo.time = time.strftime("%-I %p", time.localtime(finfo.time_dt))
-        finfo.timeIn12h = time.strftime("clock%-I", time.localtime(finfo.time_dt))
-        # finfo.ampm     = time.strftime('%p', time.localtime(finfo.time_dt))
-        # finfo.time     = time.strftime('%-I', time.localtime(finfo.time_dt))
-        finfo.timePfx = time.strftime("%p", time.localtime(finfo.time_dt))
-        finfo.temp = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["temp"]
-        finfo.feels_like = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["feels_like"]
-        finfo.humidity = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["humidity"]
-        finfo.pressure = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["pressure"]
-        finfo.icon = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["weather"][0]["icon"]
-        finfo.description = wi.weatherInfo["hourly"][
-            fi * forecastIntervalHours + forecastIntervalHours
-        ]["weather"][0][
-            "description"
-        ]  # show the first
+    # every FORECAST_INTERVAL hours, starting one interval from now
+    hours = (np.arange(forecastRange) + 1) * forecastIntervalHours
+    for fi, hour in enumerate(hours.tolist()):
+        forecastTime = timeindex.getHourLabel(int(wi.forecast.local.hour[hour]))
+        forecastTemp = wi.forecast.temp[hour]
+        forecastIcon = wi.forecast.getIcon(hour)
+        forecastDescription = wi.forecast.getDescription(hour)
 
         columnWidth = width / forecastRange
         textColor = (50, 50, 50)
         # Clock icon for the time.(Not so nice.)
-        # draw.text((20 + (fi * columnWidth),  offsetY + 90), iconMap[finfo.timeIn12h], textColor, anchor="ma",font =ImageFont.truetype(project_root + "fonts/weathericons-regular-webfont.ttf", 35))
+        # draw.text(
+        #     (20 + (fi * columnWidth), offsetY + 90),
+        #     iconMap["clock%d" % timeindex.getHour12(wi.forecast.local.hour[hour])],
+        #     textColor,
+        #     anchor="ma",
+        #     font=ImageFont.truetype(
+        #         project_root + "fonts/weathericons-regular-webfont.ttf", 35
+        #     ),
+        # )
         draw.text(
             (30 + (fi * columnWidth), offsetY + 220),
-            finfo.time,
+            forecastTime,
             textColor,
             anchor="la",
             font=getFont(fonts.normal, fontsize=12),
         )
         draw.text(
             (120 + (fi * columnWidth), offsetY + 220),
-            ("%2.1f" % finfo.temp),
+            ("%2.1f" % forecastTemp),
             textColor,
             anchor="ra",
             font=getFont(fonts.normal, fontsize=12),
@@ -978,91 +1341,240 @@ def drawWeather(wi, cv):
 
         draw.text(
             ((columnWidth / 2) + (fi * columnWidth), offsetY + 200),
-            finfo.description,
+            forecastDescription,
             textColor,
             anchor="ma",
             font=getFont(fonts.normal, fontsize=16),
         )
         draw.text(
             (70 + (fi * columnWidth), offsetY + 90),
-            iconMap[finfo.icon],
-            getDisplayColor(colorMap[finfo.icon]),
+            iconMap[forecastIcon],
+            getDisplayColor(colorMap[forecastIcon]),
             anchor="ma",
             font=getFont(fonts.icon, fontsize=80),
         )
 
 
-def annot_max(x, y, ax=None):
-    xmax = x[np.argmax(y)]
-    ymax = y.max()
-    maxTime = time.strftime("%b %-d,%-I%p", time.localtime(xmax))
-    text = maxTime + " {:.1f}C".format(ymax)
-    if not ax:
-        ax = plt.gca()
-    bbox_props = dict(boxstyle="square,pad=0.3", fc="w", ec="k", lw=0.72)
-    arrowprops = dict(arrowstyle="->", connectionstyle="angle,angleA=0,angleB=60")
-    kw = dict(
-        xycoords="data",
-        textcoords="axes fraction",
-        arrowprops=arrowprops,
-        bbox=bbox_props,
-        ha="right",
-        va="top",
-    )
+# named boxes of the layout drawWeather draws, together they cover the whole
+# canvas (see regions.py). Text running over the edge of its box makes the
+# neighbouring box dirty as well.
+def getWidgetBoxes(wi, size):
+    width, height = size
+    if hasattr(wi, "weatherInfo") is False:
+        return {"message": (0, 0, width, height)}
+
+    middle = width // 2
+    top = 300  # where the forecast area starts
+    boxes = {
+        "date": (0, 0, middle, 80),
+        "weekday": (middle, 0, width, 80),
+        "temperature": (0, 80, middle, 215),
+        "description": (middle, 80, width, 115),
+        "icon": (middle, 115, width, top),
+        "feels_like_pressure": (0, 215, middle, top),
+    }
+    if wi.mode == "1" and len(wi.weatherInfo.get("alerts", [])) > 0:
+        boxes["alert"] = (0, top, width, height)
+    elif wi.mode == "2":
+        boxes["graph"] = (0, top, width, height)
+    elif wi.mode == "3":
+        boxes["sunrise"] = (0, top, middle, height)
+        boxes["sunset"] = (middle, top, width, height)
+    elif wi.mode == "4":
+        boxes["sun"] = (0, top, width, height)
+    else:
+        forecastRange = 4
+        for fi in range(forecastRange):
+            boxes["forecast%d" % fi] = (
+                fi * width // forecastRange,
+                top,
+                (fi + 1) * width // forecastRange,
+                height,
+            )
+    return boxes
+
 
-    fpath = "/home/pi/inky/weather-impression/fonts/Roboto-Black.ttf"
-    prop = fm.FontProperties(fname=fpath)
-    ax.annotate(text, xy=(xmax, ymax), xytext=(0.93, 1.56), fontproperties=prop, **kw)
+# fingerprint of what decides about the frame shown besides its pixels : the
+# display and the settings the driver uses to turn them into panel colors
+def getFrameKey(cv, display_name):
+    settings = (display_name, cv.mode, cv.size, saturation, color_palette)
+    return hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()
 
 
-def initGPIO():
-    chip = gpiod.chip(0)  # 0 chip
-    pin = 4
-    gpiod_pin = chip.get_line(pin)
-    config = gpiod.line_request()
-    config.consumer = "Blink"
-    config.request_type = gpiod.line_request.DIRECTION_OUTPUT
-    gpiod_pin.request(config)
-    return gpiod_pin
+# widget hashes of the frame that was shown last, kept in tmpfs so they are
+# forgotten on reboot(the panel may have been cleared meanwhile)
+regionsPath = tmpfs_path + "weather-impression-regions.json"
 
 
-def setUpdateStatus(gpiod_pin, busy):
-    if busy is True:
-        gpiod_pin.set_value(1)
+# new canvas with the weather drawn for the panel size of wi
+# only the values change between refreshes, the static parts come from a copy
+# of the cached layer
+def renderFrame(wi):
+    if hasattr(wi, "weatherInfo") is False:
+        # the error screen, wi.mode is missing when the config could not be read
+        cv = newCanvas(wi)
+        with timing.span("draw.mode" + getattr(wi, "mode", "")):
+            drawWeather(wi, cv)
     else:
-        gpiod_pin.set_value(0)
+        cv = getStaticLayer(wi).copy()
+        with timing.span("draw.mode" + wi.mode):
+            drawWeather(wi, cv, static_layer=True)
 
+    if cv.mode == "P":
+        cv = quantize.remapCanvas(cv, saturation)
+    return cv
 
-def update():
-    if not DEBUG:
-        gpio_pin = initGPIO()
-        setUpdateStatus(gpio_pin, True)
-    
-    logging.info('Weather information object setup START')
-    wi = weatherInfomation()
-    logging.info('Weather information object setup END')
-    
-    cv = Image.new("RGB", getCanvasSize(wi.inky_size), getDisplayColor(WHITE))
-    
-    logging.info('Prepare screen content START')
-    drawWeather(wi, cv)
-    logging.info('Prepare screen content END')
-
-    cv.show()
-
-    if not DEBUG:
-        logging.info('Draw on screen START')
-        _Inky = Inky_Impressions_57 if wi.inky_size == "57" else Inky_Impressions_73
-        inky = _Inky()
-        logging.info('Set Image START ...')
-        inky.set_image(cv, saturation=saturation)
-        logging.info('Set Image END ...')
-        logging.info('Show Inky START ...') # long running
-        inky.show()
-        logging.info('Show Inky END ...')
-        logging.info('Draw on screen END')
-
-        setUpdateStatus(gpio_pin, False)
+
+# draw wi on screen, returns False when the panel already shows the frame
+# force : refresh the panel even if it already shows the same frame
+def showFrame(wi, screen, force=False):
+    cv = renderFrame(wi)
+    logging.info('Font cache : ' + str(getFontCacheInfo()))
+    logging.info('Text measure cache : ' + str(textmeasure.getCacheInfo()))
+
+    if DEBUG:
+        cv.show()
+
+    if wi.quantize == "pil" and cv.mode != "P":
+        # the driver takes the indexed image as it is
+        with timing.span("quantize"):
+            cv = quantize.quantizeImage(cv, saturation)
+
+    with timing.span("hash"):
+        frameRegions = regions.getRegions(
+            cv, getFrameKey(cv, screen.name), getWidgetBoxes(wi, cv.size)
+        )
+        dirty = regions.getDirtyWidgets(regions.load(regionsPath), frameRegions)
+    if screen.skip_unchanged and force is False and len(dirty) == 0:
+        # a panel refresh takes long and wears the panel, skip it
+        logging.info('Frame unchanged, skip drawing on screen')
+        return False
+
+    logging.info(
+        "Dirty regions : %s %s, %d%% of the frame"
+        % (
+            ", ".join(dirty) or "none",
+            regions.getDirtyBox(frameRegions, dirty),
+            regions.getDirtyArea(frameRegions, dirty, cv.size) * 100,
+        )
+    )
+    with timing.span("display", dirty=len(dirty)):
+        screen.show(cv, saturation)
+    regions.store(regionsPath, frameRegions)
+    return True
+
+
+# one shot refresh, everything is set up again for this frame.
+def update(force=False):
+    return renderService().refresh("update", force)
+
+
+# long running renderer for watcher.py. The display driver and its GPIO
+# line, the fonts, the HTTP session and the parsed config stay resident, a
+# refresh only fetches (or reads the cache), draws and shows the frame.
+# config.txt is parsed again when its mtime or size changed, mode, unit and
+# the one time message come from the state store (state.py) on top of it.
+# the stage timings are exported to tmpfs after every refresh, see timing.py
+class renderService(object):
+    def __init__(self, config_path=None, state_path=None):
+        self.config_path = config_path or project_root + "/config.txt"
+        self.config = None
+        self.config_stamp = None
+        self.state = state.stateStore(state_path or project_root + "/state.json")
+        self.screen = None
+        self.screen_key = None
+        # one refresh at a time, the panel can't take two show() calls
+        self.lock = threading.Lock()
+        # time of the next scheduled refresh, planned after every refresh
+        self.next_refresh = budget.getFirstRefresh()
+        self.plan_lock = threading.Lock()
+
+    def getConfigStamp(self):
+        stat = os.stat(self.config_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def loadConfig(self):
+        import configparser
+
+        stamp = self.getConfigStamp()
+        if self.config is None or stamp != self.config_stamp:
+            with timing.span("config"):
+                config = configparser.ConfigParser()
+                with open(self.config_path) as configFile:
+                    config.read_file(configFile)
+            self.state.seed(config, stamp)
+            self.config = config
+            self.config_stamp = stamp
+        self.state.apply(self.config)
+        return self.config
+
+    # state on top of the current config.txt, for the buttons
+    def loadState(self):
+        self.loadConfig()
+        return self.state
+
+    # the driver is created again only when DISPLAY or INKY_SIZE changed
+    def getScreen(self, config):
+        name = getDisplayName(config)
+        inky_size = config.get("openweathermap", "INKY_SIZE")
+        if self.screen_key != (name, inky_size):
+            self.screen = display.getDisplay(
+                name, inky_size, tmpfs_path + "weather-impression.png"
+            )
+            self.screen_key = (name, inky_size)
+        return self.screen
+
+    # load the fonts, parse the config and create the display driver ahead
+    # of the first refresh. Under the refresh lock, a refresh that comes in
+    # meanwhile must not create a second driver or seed the state as well.
+    def prepare(self):
+        warmFonts()
+        with self.lock:
+            self.getScreen(self.loadConfig())
+
+    # True once the next scheduled refresh is due, the plan is taken so the
+    # refresh is requested only once
+    def takeDueRefresh(self, now=None):
+        with self.plan_lock:
+            if self.next_refresh is None or (now or time.time()) < self.next_refresh:
+                return False
+            self.next_refresh = None
+            return True
+
+    # plan the next scheduled refresh from the forecast and the API budget
+    def planRefresh(self, wi):
+        if wi is None or hasattr(wi, "weatherInfo") is False:
+            interval, why = budget.getRefreshInterval(None, None, [])
+        else:
+            endpoints = ["onecall"] + (["rain"] if wi.mode2_rain == "true" else [])
+            interval, why = budget.getRefreshInterval(
+                wi.weatherInfo, wi.budget, endpoints
+            )
+        with self.plan_lock:
+            self.next_refresh = time.time() + interval
+        logging.info("Next scheduled refresh in %d min (%s)" % (interval // 60, why))
+
+    # reason : what triggered the refresh (schedule, button A...), for the logs
+    # force : refresh the panel even if it already shows the same frame
+    def refresh(self, reason="schedule", force=False):
+        wi = None
+        try:
+            with self.lock, timing.span("refresh", reason=reason, force=force):
+                config = self.loadConfig()
+                screen = self.getScreen(config)
+                # the busy LED covers the fetch as well
+                screen.setBusy(True)
+                try:
+                    with timing.span("setup"):
+                        wi = weatherInfomation(config)
+                    # the one time message is shown once
+                    self.state.update(one_time_message="")
+                    return showFrame(wi, screen, force)
+                finally:
+                    screen.setBusy(False)
+        finally:
+            self.planRefresh(wi)
+            timing.exportAll(tmpfs_path)
 
 
 if __name__ == "__main__":